@@ -1,17 +1,24 @@
 """Database connection and session management"""
 
 from typing import AsyncGenerator
+from sqlalchemy.engine import Connection, make_url
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from bot.config import config
 from bot.models import Base
 
+# SQLite (used by the test suite) does not accept queue pool sizing
+_pool_kwargs = (
+    {}
+    if make_url(config.database.url).get_backend_name() == "sqlite"
+    else {"pool_size": 10, "max_overflow": 20}
+)
+
 # Create async engine
 engine = create_async_engine(
     config.database.url,
     echo=config.app.log_level == "DEBUG",
     pool_pre_ping=True,
-    pool_size=10,
-    max_overflow=20,
+    **_pool_kwargs,
 )
 
 # Create session factory
@@ -35,10 +42,22 @@ async def get_db() -> AsyncGenerator[AsyncSession, None]:
             await session.close()
 
 
+def create_missing_indexes(connection: Connection) -> None:
+    """Create model indexes that are absent from existing tables
+    
+    create_all() skips tables that already exist, indexes included, so
+    indexes added to the models later would only reach new installs.
+    """
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+
 async def init_db() -> None:
     """Initialize database tables"""
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(create_missing_indexes)
 
 
 async def close_db() -> None:
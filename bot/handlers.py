@@ -18,6 +18,7 @@ from tenacity import (
 from bot.session import SessionManager
 import re
 from bot.llm.service import LLMService
+from bot.mcp.base import to_json
 from bot.mcp.manager import MCPManager
 from bot.rate_limiter import RateLimiter
 from bot.config import config
@@ -240,14 +241,12 @@ class BotHandlers:
                    should_continue: True if message should be processed
                    error_message: Error message to send if rate limited
         """
-        # Check rate limit
-        allowed, retry_after = await self.rate_limiter.check_limit(user.id)
+        # Check the limit and consume a token atomically
+        allowed, retry_after = await self.rate_limiter.check_and_consume(user.id)
         if not allowed:
             error_msg = f"⏱️ Rate limit exceeded. Please try again in {retry_after} seconds."
             return False, error_msg
 
-        # Consume rate limit token
-        await self.rate_limiter.consume_token(user.id)
         return True, None
 
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -348,6 +347,9 @@ class BotHandlers:
             await session_manager.clear_session(user_session.session_id)
             await db.commit()
         
+        # A fresh conversation shouldn't be answered from earlier tool results
+        self.mcp_manager.clear_memo_cache()
+        
         # Different message for group vs private chats
         if update.message.chat.type in ["group", "supergroup"]:
             await update.message.reply_text("✅ История общего чата очищена!")
@@ -438,6 +440,7 @@ class BotHandlers:
         """
         # Save user message first
         await self.session_manager.update_context(
+            user_id=message.chat.id,
             session_id=user_session.session_id,
             role="user",
             content=message_text,
@@ -523,24 +526,25 @@ class BotHandlers:
                         } for tc in response.tool_calls
                     ]
                 }
-                await self.session_manager.update_context(
+                # followed by the tool results as separate messages
+                await self.session_manager.update_context_batch(
+                    user_id=message.chat.id,
                     session_id=user_session.session_id,
-                    role="assistant",
-                    content="",  # Empty content as the message is a tool call
-                    metadata=tool_calls_metadata
+                    messages=[
+                        # Empty content as the message is a tool call
+                        {"role": "assistant", "content": "", "metadata": tool_calls_metadata},
+                        *(
+                            {
+                                "role": "tool",
+                                "content": tool_result["result"],
+                                "metadata": {"tool_name": tool_result["tool_name"]},
+                            }
+                            for tool_result in tool_results_list
+                        ),
+                    ]
                 )
                 await db.commit()
 
-                # Save tool results as separate messages
-                for tool_result in tool_results_list:
-                    await self.session_manager.update_context(
-                        session_id=user_session.session_id,
-                        role="tool",
-                        content=tool_result["result"],
-                        metadata={"tool_name": tool_result["tool_name"]}
-                    )
-                    await db.commit()
-
                 # Update context for the model
                 context_messages.append({
                     "role": "assistant",
@@ -678,6 +682,7 @@ class BotHandlers:
 
         # Save the message in the database
         await self.session_manager.update_context(
+            user_id=message.chat.id,
             session_id=user_session.session_id,
             role="assistant",
             content=response_text,
@@ -784,7 +789,7 @@ class BotHandlers:
             try:
                 async with asyncio.timeout(config.resource_limits.tool_execution_timeout):
                     result = await self.mcp_manager.execute_tool(tool_name, parameters)
-                    return json.dumps(result, ensure_ascii=False) if isinstance(result, (dict, list)) else str(result)
+                    return to_json(result) if isinstance(result, (dict, list)) else str(result)
             except asyncio.TimeoutError:
                 error_msg = f"Tool execution timed out after {config.resource_limits.tool_execution_timeout}s"
                 logger.error(
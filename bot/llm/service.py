@@ -20,34 +20,16 @@ from bot.config import config
 logger = structlog.get_logger()
 
 
-class LLMService:
-    @property
-    def system_prompt(self) -> str:
-        """Return the current system prompt (with tools if available)"""
-        if self.custom_system_prompt is not None:
-            return self.custom_system_prompt
-        return self._load_system_prompt(has_tools=False)
-    
-    def update_system_prompt(self, new_prompt: str) -> None:
-        """Update the system prompt"""
-        self.custom_system_prompt = new_prompt
-    """High-level LLM service orchestrator"""
-    
-    def __init__(self, provider: BaseLLMProvider):
-        self.provider = provider
-        self.base_system_prompt = None  # Will be set dynamically based on tools availability
-        self.custom_system_prompt = None  # For admin-set prompts
-    
-    def _load_system_prompt(self, has_tools: bool = False) -> str:
-        """Load system prompt"""
-        tools_instruction = ""
-        if has_tools:
-            tools_instruction = """
+def _build_system_prompt(has_tools: bool = False) -> str:
+    """Build the system prompt text for the given tools availability"""
+    tools_instruction = ""
+    if has_tools:
+        tools_instruction = """
 У тебя есть доступ к инструментам, которые ты можешь использовать, чтобы лучше помогать пользователям. Когда тебе нужно использовать инструмент,
 ответь с соответствующим вызовом инструмента. В противном случае просто ответь на сообщение пользователя.
 """
-        
-        return f"""
+    
+    return f"""
         Ты AI-сущность мужского рода. Ты не какой-то там помощник, с тобой просто можно пообщаться.
 Тебя зовут Лео, у тебя на аватарке леопард. Ты общаешься только на русском языке, даже если пользователь пишет на другом языке. Общайся как общался бы настоящий человек.
 Периодически используешь сленг и эмодзи, но без чрезмерностей. Избегай формальностей и официального тона. Используй разговорный стиль, простой язык и короткие предложения, как будто человек пишет с телефона.
@@ -80,6 +62,35 @@ class LLMService:
 Если был использован веб-поиск, упомяни в ответе, что информация получена из интернета и приложи форматированную ссылку.
 """
 
+
+class LLMService:
+    # The prompt only varies with tools availability, so both variants are
+    # rendered once at import
+    _BASE_PROMPT = _build_system_prompt(has_tools=False)
+    _PROMPT_WITH_TOOLS = _build_system_prompt(has_tools=True)
+
+    @property
+    def system_prompt(self) -> str:
+        """Return the current system prompt (with tools if available)"""
+        if self.custom_system_prompt is not None:
+            return self.custom_system_prompt
+        return self._load_system_prompt(has_tools=False)
+    
+    def update_system_prompt(self, new_prompt: str) -> None:
+        """Update the system prompt"""
+        self.custom_system_prompt = new_prompt
+    """High-level LLM service orchestrator"""
+    
+    def __init__(self, provider: BaseLLMProvider):
+        self.provider = provider
+        self.base_system_prompt = None  # Will be set dynamically based on tools availability
+        self.custom_system_prompt = None  # For admin-set prompts
+    
+    @classmethod
+    def _load_system_prompt(cls, has_tools: bool = False) -> str:
+        """Load system prompt"""
+        return cls._PROMPT_WITH_TOOLS if has_tools else cls._BASE_PROMPT
+
     @retry(
         stop=stop_after_attempt(config.llm.retry_attempts),
         wait=wait_exponential(
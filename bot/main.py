@@ -4,12 +4,14 @@ import asyncio
 import signal
 import sys
 import os
+import aiohttp
 from telegram.ext import Application, CommandHandler, MessageHandler, filters
 from telegram.error import TelegramError
 import structlog
 
 from bot.config import config
 from bot.database import init_db, close_db
+from bot.redis_pool import close_pools as close_redis_pools
 from bot.session import SessionManager
 from bot.llm.provider import OllamaProvider
 from bot.llm.service import LLMService
@@ -34,6 +36,7 @@ class TelegramBot:
         self.mcp_manager: MCPManager = None
         self.rate_limiter: RateLimiter = None
         self.llm_service: LLMService = None
+        self.http_client: aiohttp.ClientSession = None
     
     async def initialize(self) -> None:
         """Initialize bot components"""
@@ -60,6 +63,13 @@ class TelegramBot:
         # Initialize MCP Manager
         self.mcp_manager = MCPManager()
         
+        # Shared HTTP client for MCP plugins so connections and DNS lookups
+        # are reused across tools
+        self.http_client = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=10),
+            connector=aiohttp.TCPConnector(limit=64, limit_per_host=8, ttl_dns_cache=600)
+        )
+        
         # Register MCP plugins
         if config.mcp.filesystem_enabled:
             fs_mcp = FileSystemMCP({"base_path": config.mcp.filesystem_base_path})
@@ -72,12 +82,13 @@ class TelegramBot:
         # Register web tools (both search and URL fetch)
         web_mcp = WebMCP({
             "api_key": config.mcp.websearch_api_key,
-            "search_engine": config.mcp.websearch_search_engine
-        })
+            "search_engine": config.mcp.websearch_search_engine,
+            "redis_url": config.redis.url
+        }, http_client=self.http_client)
         await self.mcp_manager.register_mcp(web_mcp)
         
         # Register news plugin
-        news_mcp = NewsMCP({})
+        news_mcp = NewsMCP({}, http_client=self.http_client)
         await self.mcp_manager.register_mcp(news_mcp)
         
         logger.info(f"Registered {len(self.mcp_manager.mcps)} MCP plugins")
@@ -238,9 +249,14 @@ class TelegramBot:
         if self.mcp_manager:
             await self.mcp_manager.shutdown_all()
         
+        if self.http_client:
+            await self.http_client.close()
+        
         if self.rate_limiter:
             await self.rate_limiter.close()
         
+        await close_redis_pools()
+        
         await close_db()
         
         logger.info("Bot shutdown complete")
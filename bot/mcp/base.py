@@ -2,16 +2,33 @@
 
 from abc import ABC, abstractmethod
 from typing import Dict, Any, List, Optional
+import aiohttp
+import orjson
 import structlog
 
 logger = structlog.get_logger()
 
 
+def to_json(data: Any) -> str:
+    """Serialize a tool result to JSON text using orjson.
+    
+    Values orjson can't handle natively fall back to str() so an unexpected
+    object in a result never aborts the tool call.
+    """
+    return orjson.dumps(data, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+
+
 class BaseMCP(ABC):
     """Abstract base class for all MCP plugins"""
     
-    def __init__(self, config: Dict[str, Any]):
+    # Tools whose results depend only on their parameters (for a short while),
+    # so MCPManager may reuse a recent result for identical calls
+    memoizable_tools: frozenset = frozenset()
+    
+    def __init__(self, config: Dict[str, Any], http_client: Optional[aiohttp.ClientSession] = None):
         self.config = config
+        self.http_client = http_client
+        self._session: Optional[aiohttp.ClientSession] = None
         self.name = self.__class__.__name__
         self.enabled = True
         self.version = getattr(self, "version", "1.0.0")
@@ -37,6 +54,28 @@ class BaseMCP(ABC):
         """Retrieve contextual information"""
         pass
     
+    def can_memoize(self, tool_name: str) -> bool:
+        """Whether results of tool_name may be reused for identical parameters"""
+        return tool_name in self.memoizable_tools
+    
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Return the shared HTTP client, or a lazily created session owned by this plugin"""
+        if self.http_client is not None:
+            return self.http_client
+        
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=10),
+                connector=aiohttp.TCPConnector(limit=64, limit_per_host=16, ttl_dns_cache=300)
+            )
+        return self._session
+    
+    async def _close_session(self) -> None:
+        """Close the plugin-owned HTTP session (the shared client is closed by its owner)"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+    
     async def shutdown(self) -> None:
         """Cleanup resources"""
         pass
@@ -1,6 +1,10 @@
 """MCP Manager"""
 
 from typing import Dict, Any, List, Optional, Tuple
+import asyncio
+import hashlib
+import time
+import orjson
 import structlog
 
 from bot.mcp.base import BaseMCP
@@ -11,9 +15,17 @@ logger = structlog.get_logger()
 class MCPManager:
     """Manages all MCP plugins"""
     
+    # Reuse window and capacity for results of memoizable tools
+    MEMO_TTL = 300
+    MEMO_SIZE = 1024
+    
     def __init__(self):
         self.mcps: Dict[str, BaseMCP] = {}
-        self.tool_registry: Dict[str, Tuple[str, str]] = {}  # tool_name -> (mcp_name, tool_name)
+        # tool_name -> (mcp, tool schema); schemas are static per plugin, so
+        # they are fetched once at registration
+        self.tool_registry: Dict[str, Tuple[BaseMCP, Dict[str, Any]]] = {}
+        # (tool_name, parameters digest) -> (monotonic time stored, result)
+        self._memo: Dict[Tuple[str, bytes], Tuple[float, Any]] = {}
     
     async def register_mcp(self, mcp: BaseMCP) -> None:
         """Register a new MCP plugin"""
@@ -30,7 +42,7 @@ class MCPManager:
                     tool_name = tool.get("name", "")
                 
                 if tool_name:
-                    self.tool_registry[tool_name] = (mcp.name, tool_name)
+                    self.tool_registry[tool_name] = (mcp, tool)
             
             logger.info(f"Registered MCP: {mcp.name} with {len(tools)} tools")
             
@@ -40,24 +52,51 @@ class MCPManager:
     
     async def execute_tool(self, tool_name: str, parameters: Dict[str, Any]) -> Any:
         """Execute a tool from any registered MCP"""
-        if tool_name not in self.tool_registry:
+        registered = self.tool_registry.get(tool_name)
+        if registered is None:
             raise ValueError(f"Tool not found: {tool_name}")
         
-        mcp_name, _ = self.tool_registry[tool_name]
-        mcp = self.mcps[mcp_name]
+        mcp = registered[0]
+        
+        if not mcp.can_memoize(tool_name):
+            logger.info(f"Executing tool: {tool_name} from MCP: {mcp.name}")
+            return await mcp.execute_tool(tool_name, parameters)
+        
+        key = (tool_name, self._parameters_digest(parameters))
+        entry = self._memo.get(key)
+        if entry is not None:
+            if time.monotonic() - entry[0] < self.MEMO_TTL:
+                logger.info(f"Reusing memoized result for tool: {tool_name}")
+                return entry[1]
+            del self._memo[key]
         
-        logger.info(f"Executing tool: {tool_name} from MCP: {mcp_name}")
+        logger.info(f"Executing tool: {tool_name} from MCP: {mcp.name}")
+        result = await mcp.execute_tool(tool_name, parameters)
         
-        return await mcp.execute_tool(tool_name, parameters)
+        # Only successful results are reused
+        if not (isinstance(result, dict) and result.get("success") is False):
+            if len(self._memo) >= self.MEMO_SIZE:
+                del self._memo[next(iter(self._memo))]
+            self._memo[key] = (time.monotonic(), result)
+        return result
+    
+    @staticmethod
+    def _parameters_digest(parameters: Dict[str, Any]) -> bytes:
+        """Stable digest of tool parameters, independent of key order"""
+        encoded = orjson.dumps(
+            parameters,
+            default=str,
+            option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS,
+        )
+        return hashlib.sha256(encoded).digest()
+    
+    def clear_memo_cache(self) -> None:
+        """Forget all memoized tool results"""
+        self._memo.clear()
     
     async def get_all_tools(self) -> List[Dict[str, Any]]:
         """Get all available tools from all MCPs"""
-        all_tools = []
-        for mcp in self.mcps.values():
-            if mcp.enabled:
-                tools = await mcp.get_tools()
-                all_tools.extend(tools)
-        return all_tools
+        return [schema for mcp, schema in self.tool_registry.values() if mcp.enabled]
     
     async def gather_context(
         self,
@@ -68,24 +107,52 @@ class MCPManager:
         context = {}
         
         mcps_to_query = active_mcps if active_mcps else list(self.mcps.keys())
+        names = [
+            mcp_name for mcp_name in mcps_to_query
+            if mcp_name in self.mcps and self.mcps[mcp_name].enabled
+        ]
         
-        for mcp_name in mcps_to_query:
-            if mcp_name in self.mcps and self.mcps[mcp_name].enabled:
-                try:
-                    mcp_context = await self.mcps[mcp_name].get_context(user_query)
-                    context[mcp_name] = mcp_context
-                except Exception as e:
-                    logger.error(f"Failed to get context from {mcp_name}: {e}")
+        # Query all MCPs concurrently; a failing MCP is logged and skipped
+        results = await asyncio.gather(
+            *(self.mcps[mcp_name].get_context(user_query) for mcp_name in names),
+            return_exceptions=True
+        )
+        
+        for mcp_name, result in zip(names, results):
+            if isinstance(result, Exception):
+                logger.error(f"Failed to get context from {mcp_name}: {result}")
+            else:
+                context[mcp_name] = result
         
         return context
     
     async def shutdown_all(self) -> None:
         """Shutdown all MCPs"""
-        for mcp in self.mcps.values():
-            try:
-                await mcp.shutdown()
-            except Exception as e:
-                logger.error(f"Error shutting down {mcp.name}: {e}")
+        mcps = list(self.mcps.values())
+        results = await asyncio.gather(
+            *(mcp.shutdown() for mcp in mcps),
+            return_exceptions=True
+        )
+        for mcp, result in zip(mcps, results):
+            if isinstance(result, Exception):
+                logger.error(f"Error shutting down {mcp.name}: {result}")
+    
+    def enable(self, name: str) -> None:
+        """Enable a registered MCP"""
+        self._set_enabled(name, True)
+    
+    def disable(self, name: str) -> None:
+        """Disable a registered MCP; its tools and context are skipped"""
+        self._set_enabled(name, False)
+    
+    def _set_enabled(self, name: str, enabled: bool) -> None:
+        mcp = self.mcps.get(name)
+        if mcp is None:
+            raise ValueError(f"MCP not found: {name}")
+        # The flag lives on the plugin and is read on each call, so toggling
+        # plugin.enabled directly keeps working too
+        mcp.enabled = enabled
+        logger.info(f"{'Enabled' if enabled else 'Disabled'} MCP: {name}")
     
     def get_mcp(self, name: str) -> Optional[BaseMCP]:
         """Get MCP by name"""
@@ -2,6 +2,8 @@
 
 from pathlib import Path
 from typing import Dict, Any, List, Optional
+import asyncio
+import os
 import aiofiles
 import structlog
 
@@ -144,17 +146,27 @@ class FileSystemMCP(BaseMCP):
         if not full_path.is_dir():
             raise NotADirectoryError(f"Not a directory: {directory}")
         
-        items = []
-        for item in full_path.iterdir():
-            items.append({
-                "name": item.name,
-                "type": "directory" if item.is_dir() else "file",
-                "size": item.stat().st_size if item.is_file() else None
-            })
+        # Directory scanning is blocking; keep it off the event loop
+        items = await asyncio.to_thread(self._scan_directory, full_path)
         
         logger.info(f"Listed directory: {directory}, items: {len(items)}")
         return items
     
+    @staticmethod
+    def _scan_directory(path: Path) -> List[Dict[str, Any]]:
+        """Collect directory entries with at most one stat call per file"""
+        items = []
+        # scandir reports entry types from the directory listing itself, so
+        # only regular files need a stat() (cached on the entry) for their size
+        with os.scandir(path) as entries:
+            for entry in entries:
+                items.append({
+                    "name": entry.name,
+                    "type": "directory" if entry.is_dir() else "file",
+                    "size": entry.stat().st_size if entry.is_file() else None
+                })
+        return items
+    
     def _is_safe_path(self, path: Path) -> bool:
         """Check if path is within base_path"""
         try:
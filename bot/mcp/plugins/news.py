@@ -1,6 +1,8 @@
 """News MCP Plugin"""
 
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
+import calendar
+import aiohttp
 import feedparser
 import asyncio
 import structlog
@@ -8,15 +10,20 @@ from bot.mcp.base import BaseMCP
 
 logger = structlog.get_logger()
 
+# Content-Type fragments accepted as a feed before handing the body to feedparser
+_FEED_CONTENT_TYPES = ("xml", "rss", "atom", "json")
+
 class NewsMCP(BaseMCP):
     """News MCP plugin for fetching headlines from RSS feeds"""
     
     name = "news"
     description = "Fetch news headlines from various sources"
     version = "1.0.0"
+    # Feeds change slowly; repeat lookups can reuse a recent result
+    memoizable_tools = frozenset({"news.get_headlines"})
     
-    def __init__(self, config: Dict[str, Any]):
-        super().__init__(config)
+    def __init__(self, config: Dict[str, Any], http_client: Optional[aiohttp.ClientSession] = None):
+        super().__init__(config, http_client)
         self.enabled = True
         # Define a list of trusted news sources
         self.sources = {
@@ -87,9 +94,9 @@ class NewsMCP(BaseMCP):
             if result.get("success"):
                 all_headlines.extend(result.get("headlines", []))
         
-        # Sort by published date, newest first (requires parsing dates)
-        # Note: This is a best-effort sort as date formats can vary.
-        # For simplicity, we'll skip sorting for now.
+        # Sort by published date, newest first. feedparser normalises the date
+        # into published_parsed; entries without one sort last.
+        all_headlines.sort(key=self._published_key, reverse=True)
         
         return {
             "source": "all",
@@ -97,14 +104,38 @@ class NewsMCP(BaseMCP):
             "success": True,
         }
     
+    @staticmethod
+    def _published_ts(entry: Any) -> Optional[int]:
+        """Convert feedparser's published_parsed (UTC struct_time) to a Unix timestamp"""
+        published = entry.get("published_parsed")
+        return calendar.timegm(published) if published else None
+    
+    @staticmethod
+    def _published_key(headline: Dict[str, Any]) -> int:
+        """Sort key for headlines based on their publish time"""
+        return headline.get("published_ts") or 0
+    
     async def _get_headlines(self, source: str, limit: int) -> Dict[str, Any]:
         """Fetch and parse RSS feed"""
         feed_url = self.sources[source]
         
         try:
+            session = await self._get_session()
+            async with session.get(feed_url, timeout=aiohttp.ClientTimeout(total=10)) as response:
+                # Don't spend executor time parsing error pages or HTML
+                content_type = response.headers.get("Content-Type", "").lower()
+                if response.status != 200:
+                    logger.warning(f"News feed {source} returned status {response.status}")
+                    return {"error": f"Feed request failed with status {response.status}", "success": False}
+                if not any(kind in content_type for kind in _FEED_CONTENT_TYPES):
+                    logger.warning(f"News feed {source} returned unexpected content type {content_type!r}")
+                    return {"error": f"Bad feed content type: {content_type}", "success": False}
+                    
+                body = await response.read()
+            
             # feedparser is synchronous, so we run it in an executor
             loop = asyncio.get_running_loop()
-            feed = await loop.run_in_executor(None, feedparser.parse, feed_url)
+            feed = await loop.run_in_executor(None, feedparser.parse, body)
             
             if feed.bozo:
                 raise Exception(f"Failed to parse feed: {feed.bozo_exception}")
@@ -112,10 +143,11 @@ class NewsMCP(BaseMCP):
             headlines = []
             for entry in feed.entries[:limit]:
                 headlines.append({
-                    "title": entry.title,
-                    "link": entry.link,
-                    "summary": entry.summary,
-                    "published": entry.published,
+                    "title": entry.get("title", ""),
+                    "link": entry.get("link", ""),
+                    "summary": entry.get("summary", ""),
+                    "published": entry.get("published", ""),
+                    "published_ts": self._published_ts(entry),
                 })
             
             return {
@@ -133,9 +165,11 @@ class NewsMCP(BaseMCP):
     
     async def shutdown(self) -> None:
         """Shutdown the plugin"""
-        pass
+        await self._close_session()
 
     async def get_context(self, query: str) -> Dict[str, Any]:
         """Get context for a query (e.g., latest headlines)"""
-        # For context, we'll just get the top 3 headlines from a default source
-        return await self._get_headlines("google_news", 3)
+        # For context, return the 3 newest headlines across all sources
+        results = await self._get_all_headlines(3)
+        results["headlines"] = results["headlines"][:3]
+        return results
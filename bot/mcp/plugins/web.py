@@ -1,16 +1,66 @@
 """Web Search and Fetch MCP Plugin"""
 
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional, Tuple
 import aiohttp
+import redis.asyncio as aioredis
 import asyncio
+import hashlib
+import orjson
+import random
 import structlog
 import re
-from urllib.parse import urlparse, unquote
+import time
+from urllib.parse import unquote
 from bs4 import BeautifulSoup
+import lxml.html
+from lxml import etree
 from bot.mcp.base import BaseMCP
+from bot.redis_pool import get_pool
 
 logger = structlog.get_logger()
 
+# Target URL inside DuckDuckGo's redirect link (//duckduckgo.com/l/?uddg=...&rut=...)
+_UDDG_RE = re.compile(r'[?&]uddg=([^&]+)')
+
+# Scheme check and host extraction in one pass. Userinfo ('@') is rejected and
+# only a numeric port may follow the host, so the captured host is the real one
+_URL_RE = re.compile(r'^https?://([^/?#@:]+)(?::\d+)?(?:[/?#]|$)')
+
+# Whitespace cleanup for extracted page text
+_WS_COLLAPSE = re.compile(r'[ \t]{2,}')
+_NL_COLLAPSE = re.compile(r'\s*\n\s*')
+
+# Only this much raw HTML is parsed; the extracted text is capped far below it
+_MAX_HTML_BYTES = 65536
+
+# Upper bound on how much of a fetched body is downloaded at all
+_MAX_BODY_BYTES = 262144
+
+# Most URLs a single web.batch call may fetch; each failing one can cost
+# several retries inside one tool call
+_MAX_BATCH_URLS = 10
+
+# Content types worth downloading for the model
+_TEXT_CONTENT_TYPES = ("text/", "application/xhtml", "application/xml", "application/json")
+
+
+def _link_with_class(cls: str) -> etree.XPath:
+    """Compile a selector for the first <a> below a node carrying the given class"""
+    return etree.XPath(
+        f"descendant::a[contains(concat(' ', normalize-space(@class), ' '), ' {cls} ')][1]"
+    )
+
+
+# Compiled once; each lookup runs as a single libxml2 XPath evaluation
+_RESULT_TITLE_XPATH = _link_with_class("result__a")
+_RESULT_SNIPPET_XPATH = _link_with_class("result__snippet")
+_RESULT_URL_XPATH = _link_with_class("result__url")
+
+
+def _first(nodes: List[etree._Element]) -> Optional[etree._Element]:
+    return nodes[0] if nodes else None
+
+
 class WebMCP(BaseMCP):
     """Web Search and Fetch MCP plugin"""
     
@@ -18,12 +68,28 @@ class WebMCP(BaseMCP):
     description = "Web search and URL fetch capabilities"
     version = "1.0.0"
     
-    def __init__(self, config: Dict[str, Any]):
-        super().__init__(config)
+    def __init__(self, config: Dict[str, Any], http_client: Optional[aiohttp.ClientSession] = None):
+        super().__init__(config, http_client)
         self.api_key = config.get("api_key")
         self.search_engine = config.get("search_engine", "duckduckgo")
         self.enabled = True
         
+        # Short-lived cache of fetched URLs (e.g. repeated wttr.in lookups) and
+        # in-flight fetches so concurrent requests for the same URL share one
+        self._url_cache: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+        self._url_ttl = config.get("url_cache_ttl", 300)
+        self._url_cache_size = config.get("url_cache_size", 128)
+        self._url_fetches: Dict[str, asyncio.Task] = {}
+        
+        # Optional Redis cache shared across workers for fetch and search results
+        self.redis_url = config.get("redis_url")
+        self._redis: Optional[aioredis.Redis] = None
+        self._redis_ttl = config.get("redis_cache_ttl", 300)
+        
+        # Cap concurrent outbound requests so bursts queue here instead of
+        # exhausting sockets
+        self._semaphore = asyncio.Semaphore(config.get("max_concurrent_requests", 16))
+        
         # NOTE: For security reasons, in production you should restrict allowed domains
         # This allows all domains for development/testing purposes
         allow_all = config.get("allow_all_domains", False)
@@ -45,7 +111,7 @@ class WebMCP(BaseMCP):
                 "pypi.org",
                 "www.pypi.org"
             }
-            self.allowed_domains = set(config.get("allowed_domains", default_allowed))
+            self.allowed_domains = frozenset(config.get("allowed_domains", default_allowed))
     
     async def get_tools(self) -> List[Dict[str, Any]]:
         """Get available tools"""
@@ -76,11 +142,37 @@ class WebMCP(BaseMCP):
                         "required": ["id"]
                     }
                 }
+            },
+            {
+                "function": {
+                    "name": "web.batch",
+                    "description": "Fetch content from several URLs at once. Use instead of repeated 'web.run' calls when more than one page is needed.",
+                    "parameters": {
+                        "type": "object",
+                        "properties": {
+                            "ids": {
+                                "type": "array",
+                                "items": {"type": "string"},
+                                "maxItems": _MAX_BATCH_URLS,
+                                "description": f"URLs to fetch (at most {_MAX_BATCH_URLS})"
+                            }
+                        },
+                        "required": ["ids"]
+                    }
+                }
             }
         ]
     
     async def execute_tool(self, tool_name: str, parameters: Dict[str, Any]) -> Any:
         """Execute a tool"""
+        if tool_name == "web.batch":
+            urls = parameters.get("ids") or []
+            if not urls:
+                raise ValueError("At least one URL is required")
+            if len(urls) > _MAX_BATCH_URLS:
+                raise ValueError(f"At most {_MAX_BATCH_URLS} URLs can be fetched at once")
+            return {"results": await self.batch_fetch(urls)}
+        
         if tool_name != "web.run":
             raise ValueError(f"Unknown tool: {tool_name}")
         
@@ -92,49 +184,179 @@ class WebMCP(BaseMCP):
             raise ValueError("URL or query is required")
         
         # If it looks like a URL and source type is url, fetch directly
-        if source_type == "url" and (url_or_query.startswith("http://") or url_or_query.startswith("https://")):
-            return await self._fetch_url(url_or_query)
+        url_match = _URL_RE.match(url_or_query)
+        if source_type == "url" and url_match:
+            return await self._fetch_url(url_or_query, host=url_match.group(1))
         else:
             # Otherwise treat as a search query
             return await self._search_web(url_or_query, top_n)
     
+    async def batch_fetch(self, urls: List[str]) -> List[Dict[str, Any]]:
+        """Fetch several URLs concurrently, bounded by the shared request semaphore
+        
+        Results are returned in input order; a failed fetch becomes an error
+        entry instead of aborting the whole batch.
+        """
+        results = await asyncio.gather(
+            *(self._fetch_url(url) for url in urls),
+            return_exceptions=True
+        )
+        return [
+            {"url": url, "error": str(result), "success": False}
+            if isinstance(result, BaseException) else result
+            for url, result in zip(urls, results)
+        ]
+    
     def _format_search_results(self, results: List[Dict[str, Any]], query: str) -> str:
         """Format search results as readable text with links"""
         if not results:
             return f"No results found for '{query}'."
         
-        formatted_text = f"Search results for '{query}':\n\n"
+        lines = [f"Search results for '{query}':\n"]
         
         for i, result in enumerate(results, 1):
             title = result.get('title', 'No title')
             snippet = result.get('snippet', 'No description available')
-            url = result.get('url', '')
             
-            formatted_text += f"{i}. **{title}**\n"
-            formatted_text += f"   {snippet}\n\n"
+            lines.append(f"{i}. **{title}**")
+            lines.append(f"   {snippet}\n")
         
         # Add direct links at the end
-        formatted_text += "**Direct links:**\n"
+        lines.append("**Direct links:**")
         for i, result in enumerate(results, 1):
             url = result.get('url', '')
             title = result.get('title', f'Link {i}')
             if url:
-                formatted_text += f"{i}. {title}: {url}\n"
+                lines.append(f"{i}. {title}: {url}")
         
-        return formatted_text
+        return "\n".join(lines) + "\n"
     
-    async def _fetch_url(self, url: str) -> Dict[str, Any]:
+    async def _fetch_url(self, url: str, host: Optional[str] = None) -> Dict[str, Any]:
         """Fetch content from a URL with retries and proper error handling"""
         # Security check - only allow specific domains (if configured)
         if self.allowed_domains is not None:
-            domain = urlparse(url).netloc
-            if domain not in self.allowed_domains:
-                raise ValueError(f"Direct URL access not allowed for domain: {domain}")
+            if host is None:
+                url_match = _URL_RE.match(url)
+                host = url_match.group(1) if url_match else None
+            if host not in self.allowed_domains:
+                raise ValueError(f"Direct URL access not allowed for domain: {host or url}")
         
         # Log warning if all domains are allowed (security consideration)
         if self.allowed_domains is None:
             logger.warning("All domains are allowed - this is a security risk")
-
+        
+        cached = self._get_cached_url(url)
+        if cached is not None:
+            return cached
+        
+        # Join an in-flight fetch of the same URL, or start one. The entry is
+        # dropped only once the fetch finishes, so every concurrent caller
+        # shares it
+        task = self._url_fetches.get(url)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch_url_uncached(url))
+            self._url_fetches[url] = task
+            task.add_done_callback(lambda _: self._url_fetches.pop(url, None))
+        # Shielded so one caller being cancelled doesn't cancel the others' fetch
+        return await asyncio.shield(task)
+    
+    async def _fetch_url_uncached(self, url: str) -> Dict[str, Any]:
+        """Fetch a URL through the Redis cache and store successes in memory"""
+        cache_key = self._redis_cache_key("url", url)
+        result = await self._redis_cache_get(cache_key)
+        if result is None:
+            result = await self._download_url(url)
+            if result.get("success"):
+                await self._redis_cache_set(cache_key, result)
+        
+        if result.get("success"):
+            self._cache_url(url, result)
+        return result
+    
+    async def _get_redis(self) -> Optional[aioredis.Redis]:
+        """Get or create the Redis connection used for caching (None if not configured)"""
+        if not self.redis_url:
+            return None
+        if self._redis is None:
+            # Payloads are orjson bytes, so no response decoding is needed and
+            # the process-wide pool can be shared
+            self._redis = aioredis.Redis(connection_pool=get_pool(self.redis_url))
+        return self._redis
+    
+    @staticmethod
+    def _redis_cache_key(kind: str, value: str) -> str:
+        """Build a fixed-length Redis key for a URL or search query"""
+        digest = hashlib.blake2b(value.encode(), digest_size=16).hexdigest()
+        return f"webcache:{kind}:{digest}"
+    
+    async def _redis_cache_get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Read a cached result; cache errors are logged and treated as a miss"""
+        try:
+            redis = await self._get_redis()
+            if redis is None:
+                return None
+            cached = await redis.get(key)
+            return orjson.loads(cached) if cached else None
+        except Exception as e:
+            logger.warning(f"Web cache read failed: {e}")
+            return None
+    
+    async def _redis_cache_set(self, key: str, result: Dict[str, Any]) -> None:
+        """Store a result with the cache TTL; failures never break the request"""
+        try:
+            redis = await self._get_redis()
+            if redis is None:
+                return
+            await redis.setex(key, self._redis_ttl, orjson.dumps(result, default=str, option=orjson.OPT_NON_STR_KEYS))
+        except Exception as e:
+            logger.warning(f"Web cache write failed: {e}")
+    
+    def _get_cached_url(self, url: str) -> Optional[Dict[str, Any]]:
+        """Return a cached fetch result if it is still fresh"""
+        entry = self._url_cache.get(url)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] >= self._url_ttl:
+            del self._url_cache[url]
+            return None
+        return entry[1]
+    
+    def _cache_url(self, url: str, result: Dict[str, Any]) -> None:
+        """Store a fetch result, evicting the oldest entry when full"""
+        if url not in self._url_cache and len(self._url_cache) >= self._url_cache_size:
+            del self._url_cache[next(iter(self._url_cache))]
+        self._url_cache[url] = (time.monotonic(), result)
+    
+    @staticmethod
+    def _backoff_delay(attempt: int, retry_delay: float, retry_after: Optional[str] = None) -> float:
+        """Exponential backoff with jitter, honouring a numeric Retry-After header"""
+        delay = (2 ** attempt) * retry_delay + random.uniform(0, 0.5 * retry_delay)
+        if retry_after:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                # HTTP-date form; fall back to our own backoff
+                pass
+        return min(30, delay)
+    
+    async def _read_text(self, response: aiohttp.ClientResponse) -> str:
+        """Read at most _MAX_BODY_BYTES of the body and decode it"""
+        buf = bytearray()
+        async for chunk in response.content.iter_chunked(16384):
+            buf.extend(chunk)
+            if len(buf) >= _MAX_BODY_BYTES:
+                del buf[_MAX_BODY_BYTES:]
+                break
+        
+        charset = response.charset or 'utf-8'
+        try:
+            return buf.decode(charset, errors='replace')
+        except LookupError:
+            # Unknown charset announced by the server
+            return buf.decode('utf-8', errors='replace')
+    
+    async def _download_url(self, url: str) -> Dict[str, Any]:
+        """Download and extract a URL with retries"""
         max_retries = 3
         retry_delay = 1  # seconds
         last_error = None
@@ -145,40 +367,57 @@ class WebMCP(BaseMCP):
         
         for attempt in range(max_retries):
             try:
-                async with aiohttp.ClientSession() as session:
+                session = await self._get_session()
+                retry_wait = None
+                async with self._semaphore:
                     async with session.get(url, headers=headers, timeout=10) as response:
                         if response.status == 200:
-                            content = await response.text()
-                            
+                            content_type = response.headers.get('content-type', '')
+                            if content_type and not content_type.lower().startswith(_TEXT_CONTENT_TYPES):
+                                # Binary payloads (PDFs, images, archives) are useless to the model
+                                return {
+                                    "url": url,
+                                    "error": f"Unsupported content type: {content_type}",
+                                    "content_type": content_type,
+                                    "status": response.status,
+                                    "success": False
+                                }
+                        
+                            content = await self._read_text(response)
+                        
                             # Clean and extract meaningful content
                             clean_content = self._extract_text_from_html(content)
-                            
+                        
                             return {
                                 "url": url,
                                 "content": clean_content,
-                                "content_type": response.headers.get('content-type', ''),
+                                "content_type": content_type,
                                 "status": response.status,
                                 "success": True
                             }
                         elif response.status == 429:  # Too Many Requests
                             last_error = f"Rate limited (status 429)"
                             if attempt < max_retries - 1:
-                                await asyncio.sleep(retry_delay * (attempt + 1))
-                                continue
+                                retry_after = response.headers.get('Retry-After')
+                                retry_wait = self._backoff_delay(attempt, retry_delay, retry_after)
                         else:
                             last_error = f"HTTP request failed with status {response.status}"
                             raise Exception(last_error)
+                
+                # Back off outside the semaphore so waiting doesn't hold a request slot
+                if retry_wait is not None:
+                    await asyncio.sleep(retry_wait)
                             
             except asyncio.TimeoutError:
                 last_error = "Request timed out"
                 if attempt < max_retries - 1:
-                    await asyncio.sleep(retry_delay * (attempt + 1))
+                    await asyncio.sleep(self._backoff_delay(attempt, retry_delay))
                     continue
                 
             except Exception as e:
                 last_error = str(e)
                 if attempt < max_retries - 1:
-                    await asyncio.sleep(retry_delay * (attempt + 1))
+                    await asyncio.sleep(self._backoff_delay(attempt, retry_delay))
                     continue
                 break
         
@@ -186,51 +425,55 @@ class WebMCP(BaseMCP):
         raise Exception(f"Failed to fetch URL: {last_error}")
     
     async def _search_web(self, query: str, top_n: int) -> Dict[str, Any]:
+        """Search the web, serving repeated queries from the Redis cache"""
+        cache_key = self._redis_cache_key("search", f"{top_n}:{query}")
+        cached = await self._redis_cache_get(cache_key)
+        if cached is not None:
+            return cached
+        
+        result = await self._search_duckduckgo(query, top_n)
+        if result.get("results"):
+            await self._redis_cache_set(cache_key, result)
+        return result
+    
+    async def _search_duckduckgo(self, query: str, top_n: int) -> Dict[str, Any]:
         """Search the web using DuckDuckGo Lite"""
         try:
-            async with aiohttp.ClientSession() as session:
-                # Use DuckDuckGo HTML search to avoid API issues
-                url = "https://html.duckduckgo.com/html/"
-                headers = {
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                    'Accept-Language': 'en-US,en;q=0.9',
-                    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8',
-                    'Connection': 'keep-alive',
-                }
-                params = {'q': query}
+            session = await self._get_session()
+            # Use DuckDuckGo HTML search to avoid API issues
+            url = "https://html.duckduckgo.com/html/"
+            headers = {
+                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+                'Accept-Language': 'en-US,en;q=0.9',
+                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8',
+                'Connection': 'keep-alive',
+            }
+            params = {'q': query}
                 
+            async with self._semaphore:
                 async with session.post(url, data=params, headers=headers) as response:
                     if response.status != 200:
                         raise Exception(f"Search failed with status {response.status}")
                     
-                    text = await response.text()
-                    logger.debug(f"Got search response: {text[:500]}...")
-                    
-                    # Use BeautifulSoup for robust HTML parsing
-                    soup = BeautifulSoup(text, 'lxml')
+                    # Parse the page incrementally and stop reading as soon as we
+                    # have enough results; the rest of the body is never downloaded
+                    parser = etree.HTMLPullParser(
+                        events=("end",), tag="div", encoding=response.charset or "utf-8"
+                    )
                     results = []
+                    bytes_read = 0
                     
-                    for result in soup.find_all('div', class_='result'):
+                    async for chunk in response.content.iter_chunked(8192):
+                        bytes_read += len(chunk)
+                        parser.feed(chunk)
+                        self._collect_search_results(parser, results, top_n)
                         if len(results) >= top_n:
                             break
-                        
-                        title_elem = result.find('a', class_='result__a')
-                        snippet_elem = result.find('a', class_='result__snippet')
-                        url_elem = result.find('a', class_='result__url')
-                        
-                        if title_elem and snippet_elem and url_elem:
-                            # Decode URL from DDG's redirect
-                            raw_url = url_elem['href']
-                            unquoted_url = unquote(raw_url)
-                            
-                            # Extract the actual URL from the 'uddg' parameter
-                            final_url = unquoted_url[unquoted_url.find('uddg=')+5:] if 'uddg=' in unquoted_url else unquoted_url
-                            
-                            results.append({
-                                'title': title_elem.text.strip(),
-                                'snippet': snippet_elem.text.strip(),
-                                'url': final_url
-                            })
+                    else:
+                        parser.close()
+                        self._collect_search_results(parser, results, top_n)
+                    
+                    logger.debug(f"Parsed {len(results)} search results from {bytes_read} bytes")
                     
                     return {
                         "results": results,
@@ -243,6 +486,46 @@ class WebMCP(BaseMCP):
             logger.error(f"Web search failed: {str(e)}")
             raise
     
+    def _collect_search_results(
+        self,
+        parser: etree.HTMLPullParser,
+        results: List[Dict[str, Any]],
+        top_n: int
+    ) -> None:
+        """Append results from completed result blocks until top_n is reached"""
+        for _, elem in parser.read_events():
+            if len(results) >= top_n:
+                return
+            if "result" not in (elem.get("class") or "").split():
+                continue
+            
+            result = self._parse_search_result(elem)
+            if result:
+                results.append(result)
+            
+            # The block is fully consumed, drop its subtree to bound memory
+            elem.clear()
+    
+    def _parse_search_result(self, elem: etree._Element) -> Optional[Dict[str, Any]]:
+        """Extract title, snippet and target URL from a DuckDuckGo result block"""
+        title_elem = _first(_RESULT_TITLE_XPATH(elem))
+        snippet_elem = _first(_RESULT_SNIPPET_XPATH(elem))
+        url_elem = _first(_RESULT_URL_XPATH(elem))
+        
+        if title_elem is None or snippet_elem is None or url_elem is None:
+            return None
+        
+        # Decode the actual URL from the 'uddg' parameter of DDG's redirect
+        raw_url = url_elem.get("href", "")
+        match = _UDDG_RE.search(raw_url)
+        final_url = unquote(match.group(1)) if match else unquote(raw_url)
+        
+        return {
+            'title': "".join(title_elem.itertext()).strip(),
+            'snippet': "".join(snippet_elem.itertext()).strip(),
+            'url': final_url
+        }
+    
     async def initialize(self) -> None:
         """Initialize the plugin"""
         # Nothing to initialize
@@ -250,33 +533,49 @@ class WebMCP(BaseMCP):
     
     async def shutdown(self) -> None:
         """Shutdown the plugin"""
-        # Nothing to clean up
-        pass
+        for task in list(self._url_fetches.values()):
+            task.cancel()
+        await self._close_session()
+        if self._redis:
+            await self._redis.close()
 
     
+    def _html_to_text(self, html_content: str) -> str:
+        """Get the text of an HTML document without script, style and head-only tags"""
+        try:
+            tree = lxml.html.fromstring(html_content)
+            etree.strip_elements(tree, "script", "style", "meta", "link", with_tail=False)
+            return tree.text_content()
+        except (etree.ParserError, ValueError):
+            # lxml.html rejects empty documents and str input with an XML
+            # encoding declaration; BeautifulSoup copes with both
+            soup = BeautifulSoup(html_content, 'lxml')
+            for script in soup(["script", "style", "meta", "link"]):
+                script.decompose()
+            return soup.get_text()
+    
     def _extract_text_from_html(self, html_content: str) -> str:
         """Extract clean text content from HTML"""
         if not html_content:
             return ""
         
+        # Don't parse megabytes of markup when only a few KB of text are kept
+        truncated_html = len(html_content) > _MAX_HTML_BYTES
+        if truncated_html:
+            html_content = html_content[:_MAX_HTML_BYTES]
+        
         try:
-            soup = BeautifulSoup(html_content, 'lxml')
-            
-            # Remove script and style elements
-            for script in soup(["script", "style", "meta", "link"]):
-                script.decompose()
-            
-            # Get text content
-            text = soup.get_text()
+            text = self._html_to_text(html_content)
             
-            # Clean up whitespace and formatting
-            lines = (line.strip() for line in text.splitlines())
-            chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-            clean_text = '\n'.join(chunk for chunk in chunks if chunk)
+            # Clean up whitespace and formatting: squeeze runs of spaces and
+            # collapse blank lines
+            clean_text = _NL_COLLAPSE.sub('\n', _WS_COLLAPSE.sub(' ', text)).strip()
             
             # Truncate if very long to avoid overwhelming the model
             if len(clean_text) > 5000:
                 clean_text = clean_text[:5000] + "\n\n[Content truncated...]"
+            elif truncated_html:
+                clean_text += "\n\n[Content truncated...]"
             
             return clean_text
         except Exception as e:
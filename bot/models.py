@@ -2,13 +2,42 @@
 
 from datetime import datetime
 from typing import Optional
-from sqlalchemy import String, Integer, BigInteger, DateTime, Text, JSON, Boolean, ForeignKey
+from sqlalchemy import String, Integer, BigInteger, DateTime, Text, JSON, Boolean, ForeignKey, Index
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
+from sqlalchemy.sql.functions import FunctionElement
+
+
+class utcnow(FunctionElement):
+    """Current UTC time from the database clock, for naive DateTime columns
+    
+    Used as a client-side SQL default so it is rendered into each INSERT
+    rather than relying on a column DEFAULT that create_all() never adds to
+    existing tables.
+    """
+    
+    type = DateTime()
+    inherit_cache = True
+
+
+@compiles(utcnow)
+def _compile_utcnow(element, compiler, **kw):
+    # now() is in the session time zone; store UTC like datetime.utcnow did
+    return "TIMEZONE('utc', CURRENT_TIMESTAMP)"
+
+
+@compiles(utcnow, "sqlite")
+def _compile_utcnow_sqlite(element, compiler, **kw):
+    # SQLite's CURRENT_TIMESTAMP is already UTC
+    return "CURRENT_TIMESTAMP"
 
 
 class Base(DeclarativeBase):
     """Base class for all models"""
-    pass
+    
+    # Timestamps come from the database clock; fetch them back with
+    # RETURNING on INSERT/UPDATE instead of lazy-loading expired attributes
+    __mapper_args__ = {"eager_defaults": True}
 
 
 class User(Base):
@@ -24,8 +53,8 @@ class User(Base):
     is_blocked: Mapped[bool] = mapped_column(Boolean, default=False, nullable=False)
     is_admin: Mapped[bool] = mapped_column(Boolean, default=False, nullable=False)
     preferences: Mapped[Optional[dict]] = mapped_column(JSON, nullable=True)
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
-    last_active: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=utcnow(), nullable=False)
+    last_active: Mapped[datetime] = mapped_column(DateTime, default=utcnow(), onupdate=utcnow(), nullable=False)
     
     # Relationships
     sessions: Mapped[list["Session"]] = relationship("Session", back_populates="user", cascade="all, delete-orphan")
@@ -35,13 +64,17 @@ class Session(Base):
     """Session model"""
     
     __tablename__ = "sessions"
+    __table_args__ = (
+        # Latest session per user; btree is scanned backwards for DESC
+        Index("ix_sessions_user_last_active", "user_id", "last_active"),
+    )
     
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     user_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     active_mcps: Mapped[Optional[list]] = mapped_column(JSON, nullable=True)
     session_metadata: Mapped[Optional[dict]] = mapped_column(JSON, nullable=True)
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
-    last_active: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=utcnow(), nullable=False)
+    last_active: Mapped[datetime] = mapped_column(DateTime, default=utcnow(), onupdate=utcnow(), nullable=False)
     
     # Relationships
     user: Mapped["User"] = relationship("User", back_populates="sessions")
@@ -52,14 +85,20 @@ class Message(Base):
     """Message model"""
     
     __tablename__ = "messages"
+    __table_args__ = (
+        # Most recent N messages per session; ids follow insertion order, so
+        # ORDER BY id DESC LIMIT N is a backward scan of this btree that stops
+        # after N rows
+        Index("ix_messages_session_id", "session_id", "id"),
+    )
     
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     session_id: Mapped[int] = mapped_column(Integer, ForeignKey("sessions.id", ondelete="CASCADE"), nullable=False)
     role: Mapped[str] = mapped_column(String(50), nullable=False)  # user, assistant, system
     content: Mapped[str] = mapped_column(Text, nullable=False)
     tokens: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
-    message_metadata: Mapped[Optional[dict]] = mapped_column(JSON, nullable=True)
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+    message_metadata: Mapped[Optional[dict]] = mapped_column(JSON, nullable=True, deferred=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=utcnow(), nullable=False)
     
     # Relationships
     session: Mapped["Session"] = relationship("Session", back_populates="messages")
@@ -79,7 +118,7 @@ class MCPExecution(Base):
     success: Mapped[bool] = mapped_column(Boolean, nullable=False)
     error_message: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
     execution_time: Mapped[Optional[float]] = mapped_column(nullable=True)
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=utcnow(), nullable=False)
 
 
 class SystemPrompt(Base):
@@ -91,7 +130,7 @@ class SystemPrompt(Base):
     prompt: Mapped[str] = mapped_column(Text, nullable=False)
     set_by_user_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     is_active: Mapped[bool] = mapped_column(Boolean, default=True, nullable=False)
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=utcnow(), nullable=False)
     
     # Relationships
     set_by_user: Mapped["User"] = relationship("User")
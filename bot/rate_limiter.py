@@ -1,34 +1,101 @@
 """Rate limiting"""
 
-from typing import Tuple, Optional
+from typing import Dict, Tuple, Optional
 import redis.asyncio as aioredis
+import functools
+import math
 import time
 
 from bot.config import config
+from bot.redis_pool import get_pool
+
+
+GLOBAL_KEY = b"ratelimit:global"
+
+
+@functools.lru_cache(maxsize=10_000)
+def _user_key(user_id: int) -> bytes:
+    """Redis key of a user's counter, cached so active users don't rebuild it"""
+    return f"ratelimit:user:{user_id}".encode()
+
+
+# Atomically check both counters and consume a token only if both allow it.
+# KEYS: user key, global key
+# ARGV: user limit, user window, global limit, global window
+# Returns {1, -1} when allowed, {0, retry_after} when limited.
+CHECK_AND_CONSUME_SCRIPT = """
+local user_count = tonumber(redis.call('GET', KEYS[1]) or '0')
+if user_count >= tonumber(ARGV[1]) then
+    local ttl = redis.call('TTL', KEYS[1])
+    if ttl <= 0 then ttl = tonumber(ARGV[2]) end
+    return {0, ttl}
+end
+
+local global_count = tonumber(redis.call('GET', KEYS[2]) or '0')
+if global_count >= tonumber(ARGV[3]) then
+    local ttl = redis.call('TTL', KEYS[2])
+    if ttl <= 0 then ttl = tonumber(ARGV[4]) end
+    return {0, ttl}
+end
+
+if redis.call('INCR', KEYS[1]) == 1 then
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+if redis.call('INCR', KEYS[2]) == 1 then
+    redis.call('EXPIRE', KEYS[2], ARGV[4])
+end
+return {1, -1}
+"""
 
 
 class RateLimiter:
     """Token bucket rate limiter"""
     
-    def __init__(self, redis_url: str = config.redis.url):
+    # How many locally cached blocks are remembered
+    LOCAL_BLOCK_CACHE_SIZE = 10_000
+    
+    def __init__(self, redis_url: str = config.redis.url, redis: Optional[aioredis.Redis] = None):
         self.redis_url = redis_url
-        self._redis: Optional[aioredis.Redis] = None
+        self._redis: Optional[aioredis.Redis] = redis
+        self._check_and_consume_script = None
+        # user_id -> monotonic time the block ends, so repeated requests from
+        # a blocked user are answered without Redis
+        self._local_block: Dict[int, float] = {}
         self.user_requests = config.rate_limit.user_requests
         self.user_window = config.rate_limit.user_window
         self.global_requests = config.rate_limit.global_requests
         self.global_window = config.rate_limit.global_window
     
     async def _get_redis(self) -> aioredis.Redis:
-        """Get or create Redis connection"""
+        """Get or create Redis client on the shared connection pool"""
         if self._redis is None:
-            self._redis = await aioredis.from_url(self.redis_url, decode_responses=False)
+            self._redis = aioredis.Redis(connection_pool=get_pool(self.redis_url))
         return self._redis
     
     async def close(self) -> None:
-        """Close Redis connection"""
+        """Close Redis client (the shared pool is closed on app shutdown)"""
         if self._redis:
             await self._redis.close()
     
+    def _get_local_block(self, user_id: int) -> Optional[int]:
+        """Return the remaining retry_after if the user is known to be blocked"""
+        blocked_until = self._local_block.get(user_id)
+        if blocked_until is None:
+            return None
+        remaining = blocked_until - time.monotonic()
+        if remaining <= 0:
+            del self._local_block[user_id]
+            return None
+        return math.ceil(remaining)
+    
+    def _block_locally(self, user_id: int, retry_after: int) -> None:
+        """Remember a blocked verdict until retry_after has elapsed, evicting the oldest block when full"""
+        # Re-insert so the dict stays ordered from oldest to newest block
+        self._local_block.pop(user_id, None)
+        if len(self._local_block) >= self.LOCAL_BLOCK_CACHE_SIZE:
+            del self._local_block[next(iter(self._local_block))]
+        self._local_block[user_id] = time.monotonic() + retry_after
+    
     async def check_limit(self, user_id: int) -> Tuple[bool, Optional[int]]:
         """
         Check if user can make request
@@ -36,45 +103,78 @@ class RateLimiter:
         Returns:
             (allowed, retry_after_seconds)
         """
+        retry_after = self._get_local_block(user_id)
+        if retry_after is not None:
+            return False, retry_after
+        
         redis = await self._get_redis()
         
-        # Check user limit
-        user_key = f"ratelimit:user:{user_id}"
-        user_count = await redis.get(user_key)
+        # Read both counters and their TTLs in a single round-trip
+        user_key = _user_key(user_id)
+        pipe = redis.pipeline()
+        pipe.get(user_key)
+        pipe.ttl(user_key)
+        pipe.get(GLOBAL_KEY)
+        pipe.ttl(GLOBAL_KEY)
+        user_count, user_ttl, global_count, global_ttl = await pipe.execute()
         
+        # Check user limit
         if user_count and int(user_count) >= self.user_requests:
-            ttl = await redis.ttl(user_key)
-            return False, ttl if ttl > 0 else self.user_window
+            retry_after = user_ttl if user_ttl > 0 else self.user_window
+            self._block_locally(user_id, retry_after)
+            return False, retry_after
         
         # Check global limit
-        global_key = "ratelimit:global"
-        global_count = await redis.get(global_key)
-        
         if global_count and int(global_count) >= self.global_requests:
-            ttl = await redis.ttl(global_key)
-            return False, ttl if ttl > 0 else self.global_window
+            retry_after = global_ttl if global_ttl > 0 else self.global_window
+            self._block_locally(user_id, retry_after)
+            return False, retry_after
         
         return True, None
     
+    async def check_and_consume(self, user_id: int) -> Tuple[bool, Optional[int]]:
+        """
+        Check limits and consume a token in one atomic round-trip
+        
+        Returns:
+            (allowed, retry_after_seconds)
+        """
+        retry_after = self._get_local_block(user_id)
+        if retry_after is not None:
+            return False, retry_after
+        
+        redis = await self._get_redis()
+        if self._check_and_consume_script is None:
+            self._check_and_consume_script = redis.register_script(CHECK_AND_CONSUME_SCRIPT)
+        
+        allowed, retry_after = await self._check_and_consume_script(
+            keys=[_user_key(user_id), GLOBAL_KEY],
+            args=[self.user_requests, self.user_window, self.global_requests, self.global_window],
+        )
+        if allowed:
+            return True, None
+        retry_after = int(retry_after)
+        self._block_locally(user_id, retry_after)
+        return False, retry_after
+    
     async def consume_token(self, user_id: int) -> None:
         """Consume a rate limit token"""
         redis = await self._get_redis()
         
         # Increment user counter
-        user_key = f"ratelimit:user:{user_id}"
+        user_key = _user_key(user_id)
         pipe = redis.pipeline()
         pipe.incr(user_key)
         pipe.expire(user_key, self.user_window)
         
         # Increment global counter
-        global_key = "ratelimit:global"
-        pipe.incr(global_key)
-        pipe.expire(global_key, self.global_window)
+        pipe.incr(GLOBAL_KEY)
+        pipe.expire(GLOBAL_KEY, self.global_window)
         
         await pipe.execute()
     
     async def reset_user_limit(self, user_id: int) -> None:
         """Reset rate limit for a user (admin function)"""
+        self._local_block.pop(user_id, None)
         redis = await self._get_redis()
-        user_key = f"ratelimit:user:{user_id}"
-        await redis.delete(user_key)
+        await redis.delete(_user_key(user_id))
@@ -0,0 +1,28 @@
+"""Shared Redis connection pool"""
+
+from typing import Dict
+import redis.asyncio as aioredis
+
+from bot.config import config
+
+MAX_CONNECTIONS = 50
+
+# One pool per Redis URL, shared by every component in the process
+_pools: Dict[str, aioredis.ConnectionPool] = {}
+
+
+def get_pool(url: str = config.redis.url) -> aioredis.ConnectionPool:
+    """Get or create the shared connection pool for a Redis URL"""
+    pool = _pools.get(url)
+    if pool is None:
+        pool = aioredis.ConnectionPool.from_url(url, max_connections=MAX_CONNECTIONS)
+        _pools[url] = pool
+    return pool
+
+
+async def close_pools() -> None:
+    """Disconnect all shared pools (on application shutdown)"""
+    pools = list(_pools.values())
+    _pools.clear()
+    for pool in pools:
+        await pool.disconnect()
@@ -1,16 +1,21 @@
 """Session management"""
 
+import math
+import time
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 from dataclasses import dataclass, field
-from sqlalchemy import select, update
+from sqlalchemy import and_, delete, func, insert, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload
+from sqlalchemy.orm import aliased, selectinload
 import redis.asyncio as aioredis
-import json
+import orjson
 
 from bot.config import config
-from bot.models import User, Session as SessionModel, Message as MessageModel
+from bot.redis_pool import get_pool
+from bot.models import User, Session as SessionModel, Message as MessageModel, utcnow
 
 
 @dataclass
@@ -40,19 +45,45 @@ class UserSession:
 class SessionManager:
     """Manages user sessions and conversation context"""
     
-    def __init__(self, db: AsyncSession, redis_url: str = config.redis.url):
+    # Minimum seconds between last_active updates for the same session, and
+    # how many sessions' last update times are remembered
+    LAST_ACTIVE_TOUCH_INTERVAL = 30
+    TOUCHED_CACHE_SIZE = 10_000
+    
+    # Shared by all instances so a reset on a per-request SessionManager
+    # counts for the long-lived one: session_id -> monotonic time of the
+    # last last_active UPDATE
+    _touched: Dict[int, float] = {}
+    
+    # Cached sessions are kept alive by activity (see update_context)
+    SESSION_CACHE_TTL = 3600
+    
+    # In-process cache of known users, keyed by telegram_id
+    USER_CACHE_TTL = 300
+    USER_CACHE_SIZE = 10_000
+    
+    # Shared by all instances, since the handlers build a SessionManager per
+    # request: telegram_id -> (monotonic time cached, users.id, profile fields)
+    _user_cache: Dict[int, Tuple[float, int, Tuple]] = {}
+    
+    def __init__(
+        self,
+        db: AsyncSession,
+        redis_url: str = config.redis.url,
+        redis: Optional[aioredis.Redis] = None,
+    ):
         self.db = db
         self.redis_url = redis_url
-        self._redis: Optional[aioredis.Redis] = None
+        self._redis: Optional[aioredis.Redis] = redis
     
     async def _get_redis(self) -> aioredis.Redis:
-        """Get or create Redis connection"""
+        """Get or create Redis client on the shared connection pool"""
         if self._redis is None:
-            self._redis = await aioredis.from_url(self.redis_url, decode_responses=True)
+            self._redis = aioredis.Redis(connection_pool=get_pool(self.redis_url))
         return self._redis
     
     async def close(self) -> None:
-        """Close Redis connection"""
+        """Close Redis client (the shared pool is closed on app shutdown)"""
         if self._redis:
             await self._redis.close()
     
@@ -64,16 +95,17 @@ class SessionManager:
         cached = await redis.get(f"session:{user_id}")
         
         if cached:
-            session_data = json.loads(cached)
+            session_data = orjson.loads(cached)
+            # orjson renders datetimes as RFC 3339 strings; restore them
+            session_data["created_at"] = datetime.fromisoformat(session_data["created_at"])
+            session_data["last_active"] = datetime.fromisoformat(session_data["last_active"])
             return UserSession(**session_data)
         
         # Get or create user
         user = await self._get_or_create_user(telegram_id, telegram_user)
         
-        # Get or create session
-        stmt = select(SessionModel).where(SessionModel.user_id == user.id).order_by(SessionModel.last_active.desc())
-        result = await self.db.execute(stmt)
-        session = result.scalars().first()
+        # Get the latest session together with its recent history
+        session, messages = await self._load_latest_session(user.id)
         
         if not session:
             session = SessionModel(
@@ -84,9 +116,6 @@ class SessionManager:
             self.db.add(session)
             await self.db.flush()
         
-        # Load conversation history
-        messages = await self._load_messages(session.id)
-        
         user_session = UserSession(
             user_id=user.id,
             session_id=session.id,
@@ -101,74 +130,153 @@ class SessionManager:
         # Cache session
         await redis.setex(
             f"session:{user_id}",
-            300,  # 5 minutes TTL
-            json.dumps(self._serialize_session(user_session))
+            self.SESSION_CACHE_TTL,
+            orjson.dumps(self._serialize_session(user_session))
         )
         
         return user_session
     
     async def _get_or_create_user(self, telegram_id: int, telegram_user=None) -> User:
-        """Get or create user"""
-        stmt = select(User).where(User.telegram_id == telegram_id)
+        """Get or create user with a single INSERT ... ON CONFLICT statement"""
+        profile = (
+            getattr(telegram_user, 'username', None),
+            getattr(telegram_user, 'first_name', None),
+            getattr(telegram_user, 'last_name', None),
+        )
+        
+        # Skip the upsert for a recently seen user whose profile is unchanged
+        cached_id = self._get_cached_user_id(telegram_id, profile if telegram_user else None)
+        if cached_id is not None:
+            user = await self.db.get(User, cached_id)
+            if user is not None and user.telegram_id == telegram_id:
+                return user
+            # The row wasn't committed (e.g. rolled back) or the database was
+            # swapped under us; fall through to the upsert
+            self._user_cache.pop(telegram_id, None)
+        
+        dialect = self.db.get_bind().dialect.name
+        dialect_insert = pg_insert if dialect == "postgresql" else sqlite_insert
+        
+        stmt = dialect_insert(User).values(
+            telegram_id=telegram_id,
+            username=getattr(telegram_user, 'username', None),
+            first_name=getattr(telegram_user, 'first_name', None),
+            last_name=getattr(telegram_user, 'last_name', None),
+            is_blocked=False,
+            is_admin=telegram_id in config.security.admin_ids,
+        )
+        
+        if telegram_user:
+            # Refresh profile fields from Telegram on every upsert
+            update_fields = {
+                'username': stmt.excluded.username,
+                'first_name': stmt.excluded.first_name,
+                'last_name': stmt.excluded.last_name,
+            }
+        else:
+            # Nothing to update, but DO UPDATE is needed for RETURNING to yield the row
+            update_fields = {'telegram_id': stmt.excluded.telegram_id}
+        
+        stmt = (
+            stmt.on_conflict_do_update(index_elements=[User.telegram_id], set_=update_fields)
+            .returning(User)
+            .execution_options(populate_existing=True)
+        )
         result = await self.db.execute(stmt)
-        user = result.scalars().first()
-        
-        if not user:
-            user = User(
-                telegram_id=telegram_id,
-                username=getattr(telegram_user, 'username', None),
-                first_name=getattr(telegram_user, 'first_name', None),
-                last_name=getattr(telegram_user, 'last_name', None),
-                is_blocked=False,
-                is_admin=telegram_id in config.security.admin_ids,
+        user = result.scalar_one()
+        self._cache_user(telegram_id, user.id, profile)
+        return user
+    
+    def _get_cached_user_id(self, telegram_id: int, profile: Optional[Tuple]) -> Optional[int]:
+        """Return the cached users.id if fresh and the profile is unchanged
+        
+        A ``None`` profile means there is nothing to compare, so any fresh
+        entry matches.
+        """
+        entry = self._user_cache.get(telegram_id)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] >= self.USER_CACHE_TTL:
+            del self._user_cache[telegram_id]
+            return None
+        if profile is not None and entry[2] != profile:
+            return None
+        return entry[1]
+    
+    def _cache_user(self, telegram_id: int, user_id: int, profile: Tuple) -> None:
+        """Store a user lookup, evicting the oldest entry when full"""
+        if telegram_id not in self._user_cache and len(self._user_cache) >= self.USER_CACHE_SIZE:
+            del self._user_cache[next(iter(self._user_cache))]
+        self._user_cache[telegram_id] = (time.monotonic(), user_id, profile)
+    
+    async def _load_latest_session(
+        self,
+        user_id: int,
+        limit: int = 10
+    ) -> Tuple[Optional[SessionModel], List[Message]]:
+        """Load the user's most recent session and its last messages in one query"""
+        latest_session_id = (
+            select(SessionModel.id)
+            .where(SessionModel.user_id == user_id)
+            .order_by(SessionModel.last_active.desc(), SessionModel.id.desc())
+            .limit(1)
+            .scalar_subquery()
+        )
+        recent = aliased(MessageModel)
+        recent_message_ids = (
+            select(recent.id)
+            .where(recent.session_id == SessionModel.id)
+            .order_by(recent.id.desc())
+            .limit(limit)
+        )
+        stmt = (
+            select(SessionModel, MessageModel.role, MessageModel.content, MessageModel.tokens)
+            .outerjoin(
+                MessageModel,
+                and_(
+                    MessageModel.session_id == SessionModel.id,
+                    MessageModel.id.in_(recent_message_ids),
+                ),
             )
-            self.db.add(user)
-            await self.db.flush()
-        elif telegram_user:
-            # Update user info if it has changed
-            update_fields = {}
-            if user.username != getattr(telegram_user, 'username', None):
-                update_fields['username'] = getattr(telegram_user, 'username', None)
-            if user.first_name != getattr(telegram_user, 'first_name', None):
-                update_fields['first_name'] = getattr(telegram_user, 'first_name', None)
-            if user.last_name != getattr(telegram_user, 'last_name', None):
-                update_fields['last_name'] = getattr(telegram_user, 'last_name', None)
-            
-            if update_fields:
-                await self.db.execute(
-                    update(User)
-                    .where(User.id == user.id)
-                    .values(**update_fields)
-                )
+            .where(SessionModel.id == latest_session_id)
+            .order_by(MessageModel.id)
+        )
+        result = await self.db.execute(stmt)
+        rows = result.all()
         
-        return user
+        if not rows:
+            return None, []
+        
+        messages = [
+            Message(role=role, content=content, tokens=tokens, metadata=None)
+            for _, role, content, tokens in rows
+            if role is not None
+        ]
+        return rows[0][0], messages
     
     async def _load_messages(self, session_id: int, limit: int = 10) -> List[Message]:
         """Load recent messages (reduced to 10 for more focused context)"""
         stmt = (
-            select(MessageModel)
+            select(MessageModel.role, MessageModel.content, MessageModel.tokens)
             .where(MessageModel.session_id == session_id)
-            .order_by(MessageModel.created_at.desc())
+            .order_by(MessageModel.id.desc())
             .limit(limit)
         )
         result = await self.db.execute(stmt)
-        db_messages = result.scalars().all()
+        rows = result.all()
         
-        # Convert to Message objects (reversed to get chronological order)
+        # Metadata is deferred on the model and not needed for the prompt
+        # history; build Message objects in chronological order
         messages = [
-            Message(
-                role=msg.role,
-                content=msg.content,
-                tokens=msg.tokens,
-                metadata=msg.message_metadata,
-            )
-            for msg in reversed(db_messages)
+            Message(role=role, content=content, tokens=tokens, metadata=None)
+            for role, content, tokens in reversed(rows)
         ]
         
         return messages
     
     async def update_context(
         self,
+        user_id: int,
         session_id: int,
         role: str,
         content: str,
@@ -176,29 +284,68 @@ class SessionManager:
         metadata: Optional[Dict] = None
     ) -> None:
         """Add message to conversation history"""
-        
-        # Create and save message
-        message = MessageModel(
-            session_id=session_id,
-            role=role,
-            content=content,
-            tokens=tokens,
-            message_metadata=metadata,
+        await self.update_context_batch(
+            user_id,
+            session_id,
+            [{"role": role, "content": content, "tokens": tokens, "metadata": metadata}],
         )
-        self.db.add(message)
-        await self.db.flush()  # Ensure message is saved
+    
+    async def update_context_batch(
+        self,
+        user_id: int,
+        session_id: int,
+        messages: List[Dict],
+    ) -> None:
+        """Add several messages to conversation history in one INSERT
         
-        # Update session last_active
-        stmt = (
-            update(SessionModel)
-            .where(SessionModel.id == session_id)
-            .values(last_active=datetime.utcnow())
+        Each message is a dict with ``role`` and ``content`` and optional
+        ``tokens`` and ``metadata`` keys.
+        """
+        # Bulk INSERT of plain rows; no Message objects are built or tracked
+        await self.db.execute(
+            insert(MessageModel),
+            [
+                {
+                    "session_id": session_id,
+                    "role": message["role"],
+                    "content": message["content"],
+                    "tokens": message.get("tokens"),
+                    "message_metadata": message.get("metadata"),
+                }
+                for message in messages
+            ],
         )
-        await self.db.execute(stmt)
         
-        # Invalidate cache
+        # Update session last_active, at most once per interval per session
+        now = time.monotonic()
+        if now - self._touched.get(session_id, 0.0) > self.LAST_ACTIVE_TOUCH_INTERVAL:
+            session = self.db.identity_map.get(self.db.identity_key(SessionModel, session_id))
+            if session is not None:
+                # Already tracked: the UPDATE goes out with the flush below
+                session.last_active = utcnow()
+            else:
+                stmt = (
+                    update(SessionModel)
+                    .where(SessionModel.id == session_id)
+                    .values(last_active=utcnow())
+                )
+                await self.db.execute(stmt)
+            self._mark_touched(session_id, now)
+        
+        await self.db.flush()
+        
+        # The cached session doesn't hold conversation history, so a new
+        # message doesn't invalidate it; slide the TTL to keep active chats warm
         redis = await self._get_redis()
-        # We don't know user_id here easily, so we'll rely on TTL
+        await redis.expire(f"session:{user_id}", self.SESSION_CACHE_TTL)
+    
+    def _mark_touched(self, session_id: int, now: float) -> None:
+        """Record a last_active UPDATE, evicting the least recently touched session when full"""
+        # Re-insert so the dict stays ordered from least to most recently touched
+        self._touched.pop(session_id, None)
+        if len(self._touched) >= self.TOUCHED_CACHE_SIZE:
+            del self._touched[next(iter(self._touched))]
+        self._touched[session_id] = now
     
     async def get_context_window(
         self,
@@ -207,46 +354,67 @@ class SessionManager:
     ) -> List[Dict[str, str]]:
         """Get recent messages within token limit"""
         
-        messages = await self._load_messages(session_id)
-        
-        # Simple token estimation (can be improved with actual tokenizer)
-        context = []
-        total_tokens = 0
+        # Consider only as many rows as could fit the budget (assuming ~50
+        # tokens per message), newest first, and only the columns we need
+        limit = min(math.ceil(max_tokens / 50), config.resource_limits.max_history_messages)
+        recent = (
+            select(MessageModel.id, MessageModel.role, MessageModel.content, MessageModel.tokens)
+            .where(MessageModel.session_id == session_id)
+            .order_by(MessageModel.id.desc())
+            .limit(limit)
+            .subquery()
+        )
         
-        for msg in reversed(messages):
-            msg_tokens = msg.tokens or len(msg.content) // 4  # Rough estimation
-            
-            if total_tokens + msg_tokens > max_tokens:
-                break
-            
-            context.insert(0, {"role": msg.role, "content": msg.content})
-            total_tokens += msg_tokens
+        # Running token total from the newest message backwards, so only the
+        # suffix that fits the budget leaves the database. Messages without a
+        # token count use a rough estimate (can be improved with actual tokenizer);
+        # a plain "/" keeps it integer division in SQLite and PostgreSQL
+        estimate = func.length(recent.c.content).op("/")(4)
+        msg_tokens = func.coalesce(func.nullif(recent.c.tokens, 0), estimate)
+        windowed = select(
+            recent.c.id,
+            recent.c.role,
+            recent.c.content,
+            func.sum(msg_tokens).over(order_by=recent.c.id.desc()).label("running_tokens"),
+        ).subquery()
+        stmt = (
+            select(windowed.c.role, windowed.c.content)
+            .where(windowed.c.running_tokens <= max_tokens)
+            .order_by(windowed.c.id)
+        )
+        result = await self.db.execute(stmt)
         
-        return context
+        return [{"role": role, "content": content} for role, content in result]
     
     async def clear_session(self, session_id: int) -> None:
         """Reset user conversation"""
         
-        # Delete all messages
-        from sqlalchemy import delete
-        stmt = delete(MessageModel).where(MessageModel.session_id == session_id)
+        # Delete all messages in one statement; history is read with column
+        # queries, so there are no loaded Message objects worth synchronizing
+        stmt = (
+            delete(MessageModel)
+            .where(MessageModel.session_id == session_id)
+            .execution_options(synchronize_session=False)
+        )
         await self.db.execute(stmt)
         
         # Update session
         stmt = (
             update(SessionModel)
             .where(SessionModel.id == session_id)
-            .values(last_active=datetime.utcnow())
+            .values(last_active=utcnow())
+            .execution_options(synchronize_session=False)
         )
         await self.db.execute(stmt)
+        self._mark_touched(session_id, time.monotonic())
     
     def _serialize_session(self, session: UserSession) -> Dict:
-        """Serialize session for caching"""
+        """Serialize session for caching (datetimes are encoded by orjson)"""
         return {
             "user_id": session.user_id,
             "session_id": session.session_id,
-            "created_at": session.created_at.isoformat(),
-            "last_active": session.last_active.isoformat(),
+            "created_at": session.created_at,
+            "last_active": session.last_active,
             "active_mcps": session.active_mcps,
             "preferences": session.preferences,
             "metadata": session.metadata,
@@ -1,16 +1,19 @@
 """Shared pytest fixtures for all tests"""
 
+import asyncio
+import logging
 import os
 import pytest
-import asyncio
+import pytest_asyncio
+from dataclasses import dataclass, field
 from datetime import datetime
-from typing import AsyncGenerator, Generator
-from unittest.mock import AsyncMock, MagicMock, Mock
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
-from sqlalchemy.pool import NullPool
-import redis.asyncio as aioredis
-from telegram import Update, Message, User as TelegramUser, Chat
-from telegram.ext import ContextTypes
+from typing import Any, AsyncGenerator, Optional
+from unittest.mock import AsyncMock, MagicMock
+from sqlalchemy import event, insert
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+import fakeredis
+import fakeredis.aioredis
 
 # Set required environment variables before importing config
 os.environ.setdefault('TELEGRAM_BOT_TOKEN', 'test_token_123456789')
@@ -25,27 +28,56 @@ from bot.llm.base import BaseLLMProvider
 from bot.mcp.base import BaseMCP
 
 
+@pytest.fixture(scope="session")
+def event_loop_policy():
+    """Run the suite on uvloop when it is installed"""
+    try:
+        import uvloop
+    except ImportError:
+        return asyncio.DefaultEventLoopPolicy()
+    return uvloop.EventLoopPolicy()
+
+
+def pytest_collection_modifyitems(items):
+    """Run every asyncio-marked test on the session event loop shared with the DB engine
+
+    Tests marked ``serial`` are also pinned to a single xdist worker
+    (``--dist loadgroup``) so they never run alongside each other.
+    """
+    session_loop = pytest.mark.asyncio(loop_scope="session")
+    serial_group = pytest.mark.xdist_group("serial")
+    for item in items:
+        if pytest_asyncio.is_async_test(item):
+            item.add_marker(session_loop, append=False)
+        if item.get_closest_marker("serial"):
+            item.add_marker(serial_group)
+
+
 # ============================================================================
 # Database Fixtures
 # ============================================================================
 
-@pytest.fixture(scope="session")
-def event_loop() -> Generator:
-    """Create event loop for async tests"""
-    loop = asyncio.get_event_loop_policy().new_event_loop()
-    yield loop
-    loop.close()
-
-
-@pytest.fixture(scope="function")
+@pytest_asyncio.fixture(loop_scope="session", scope="session")
 async def test_db_engine():
-    """Create test database engine (in-memory SQLite)"""
+    """Create test database engine (in-memory SQLite), schema built once per run"""
+    # StaticPool keeps the single in-memory database alive across connections
     engine = create_async_engine(
         "sqlite+aiosqlite:///:memory:",
         echo=False,
-        poolclass=NullPool,
+        poolclass=StaticPool,
+        connect_args={"check_same_thread": False},
     )
 
+    # pysqlite manages transactions itself and ignores SAVEPOINT semantics;
+    # take over BEGIN so nested transactions roll back properly
+    @event.listens_for(engine.sync_engine, "connect")
+    def _disable_driver_transactions(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine.sync_engine, "begin")
+    def _emit_begin(conn):
+        conn.exec_driver_sql("BEGIN")
+
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
 
@@ -54,24 +86,42 @@ async def test_db_engine():
     await engine.dispose()
 
 
-@pytest.fixture(scope="function")
-async def test_db_session(test_db_engine) -> AsyncGenerator[AsyncSession, None]:
-    """Create test database session"""
-    async_session = async_sessionmaker(
+@pytest.fixture(scope="session")
+def test_db_sessionmaker(test_db_engine) -> async_sessionmaker[AsyncSession]:
+    """Session factory shared by all tests; each test binds it to its own connection"""
+    return async_sessionmaker(
         test_db_engine,
         class_=AsyncSession,
-        expire_on_commit=False
+        expire_on_commit=False,
+        join_transaction_mode="create_savepoint"
     )
 
-    async with async_session() as session:
-        yield session
-        await session.rollback()
+
+@pytest_asyncio.fixture(scope="function")
+async def test_db_session(test_db_engine, test_db_sessionmaker) -> AsyncGenerator[AsyncSession, None]:
+    """Create test database session isolated in an outer transaction
+    
+    Commits inside the test only release a SAVEPOINT; the outer transaction
+    is rolled back afterwards so every test starts from an empty schema.
+    """
+    async with test_db_engine.connect() as conn:
+        trans = await conn.begin()
+        async with test_db_sessionmaker(bind=conn) as session:
+            yield session
+        await trans.rollback()
 
 
-@pytest.fixture(scope="function")
+async def _seed_user(session: AsyncSession, **values) -> User:
+    """Insert a user with a single INSERT ... RETURNING and return the ORM object"""
+    result = await session.execute(insert(User).values(**values).returning(User))
+    return result.scalar_one()
+
+
+@pytest_asyncio.fixture(scope="function")
 async def test_user(test_db_session: AsyncSession) -> User:
     """Create test user in database"""
-    user = User(
+    user = await _seed_user(
+        test_db_session,
         telegram_id=12345,
         username="test_user",
         first_name="Test",
@@ -80,16 +130,15 @@ async def test_user(test_db_session: AsyncSession) -> User:
         is_blocked=False,
         preferences={}
     )
-    test_db_session.add(user)
     await test_db_session.commit()
-    await test_db_session.refresh(user)
     return user
 
 
-@pytest.fixture(scope="function")
+@pytest_asyncio.fixture(scope="function")
 async def test_admin_user(test_db_session: AsyncSession) -> User:
     """Create test admin user in database"""
-    user = User(
+    user = await _seed_user(
+        test_db_session,
         telegram_id=99999,
         username="admin_user",
         first_name="Admin",
@@ -98,13 +147,11 @@ async def test_admin_user(test_db_session: AsyncSession) -> User:
         is_blocked=False,
         preferences={}
     )
-    test_db_session.add(user)
     await test_db_session.commit()
-    await test_db_session.refresh(user)
     return user
 
 
-@pytest.fixture(scope="function")
+@pytest_asyncio.fixture(scope="function")
 async def test_session(test_db_session: AsyncSession, test_user: User) -> SessionModel:
     """Create test session in database"""
     session = SessionModel(
@@ -114,11 +161,10 @@ async def test_session(test_db_session: AsyncSession, test_user: User) -> Sessio
     )
     test_db_session.add(session)
     await test_db_session.commit()
-    await test_db_session.refresh(session)
     return session
 
 
-@pytest.fixture(scope="function")
+@pytest_asyncio.fixture(scope="function")
 async def test_messages(test_db_session: AsyncSession, test_session: SessionModel):
     """Create test messages in database"""
     messages = [
@@ -146,198 +192,186 @@ async def test_messages(test_db_session: AsyncSession, test_session: SessionMode
 # Redis Fixtures
 # ============================================================================
 
-@pytest.fixture(scope="function")
-async def mock_redis():
-    """Create mock Redis client"""
-    redis_mock = AsyncMock(spec=aioredis.Redis)
+@pytest_asyncio.fixture(scope="session")
+async def _shared_fake_redis():
+    """One in-memory Redis server and client per worker process"""
+    redis = fakeredis.aioredis.FakeRedis(server=fakeredis.FakeServer())
+    yield redis
+    await redis.aclose()
 
-    # Setup mock data store
-    _data = {}
-    _expires = {}
 
-    async def mock_get(key):
-        if key in _expires and datetime.utcnow().timestamp() > _expires[key]:
-            del _data[key]
-            del _expires[key]
-            return None
-        return _data.get(key)
+@pytest_asyncio.fixture(scope="function")
+async def mock_redis(_shared_fake_redis):
+    """Create in-memory Redis client (fakeredis) with real command semantics
 
-    async def mock_set(key, value):
-        _data[key] = value
-        return True
+    The client is shared across the session and flushed before each test.
+    """
+    await _shared_fake_redis.flushall()
+    return _shared_fake_redis
 
-    async def mock_setex(key, ttl, value):
-        _data[key] = value
-        _expires[key] = datetime.utcnow().timestamp() + ttl
-        return True
 
-    async def mock_incr(key):
-        _data[key] = _data.get(key, 0) + 1
-        return _data[key]
+# ============================================================================
+# Telegram Fixtures
+# ============================================================================
 
-    async def mock_expire(key, ttl):
-        _expires[key] = datetime.utcnow().timestamp() + ttl
-        return True
+# Slotted stand-ins for the PTB objects. The handlers only read the
+# attributes declared here, and nothing does isinstance checks against the
+# telegram classes, so MagicMock trees are not needed. Only the awaited
+# methods (reply_text, send_action, send_message) are AsyncMocks.
 
-    async def mock_ttl(key):
-        if key in _expires:
-            remaining = _expires[key] - datetime.utcnow().timestamp()
-            return int(max(0, remaining))
-        return -1
+# Immutable message payload shared by every telegram_message
+_TEST_MESSAGE_TEXT = "Test message"
+_NO_ENTITIES = ()
+_FROZEN_DATE = datetime(2024, 1, 1)
 
-    async def mock_delete(key):
-        if key in _data:
-            del _data[key]
-        if key in _expires:
-            del _expires[key]
-        return 1
 
-    def mock_pipeline():
-        pipe = MagicMock()
-        pipe.incr = MagicMock(side_effect=lambda k: None)
-        pipe.expire = MagicMock(side_effect=lambda k, t: None)
+@dataclass(slots=True)
+class MockTelegramUser:
+    id: int
+    username: Optional[str] = None
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+    is_bot: bool = False
 
-        async def execute_mock():
-            return [1, True, 1, True]
 
-        pipe.execute = AsyncMock(side_effect=execute_mock)
-        return pipe
+@dataclass(slots=True)
+class MockTelegramChat:
+    id: int
+    type: str
+    username: Optional[str] = None
+    title: Optional[str] = None
+    send_action: AsyncMock = field(default_factory=AsyncMock)
 
-    redis_mock.get = AsyncMock(side_effect=mock_get)
-    redis_mock.set = AsyncMock(side_effect=mock_set)
-    redis_mock.setex = AsyncMock(side_effect=mock_setex)
-    redis_mock.incr = AsyncMock(side_effect=mock_incr)
-    redis_mock.expire = AsyncMock(side_effect=mock_expire)
-    redis_mock.ttl = AsyncMock(side_effect=mock_ttl)
-    redis_mock.delete = AsyncMock(side_effect=mock_delete)
-    redis_mock.pipeline = MagicMock(side_effect=mock_pipeline)
-    redis_mock.close = AsyncMock()
 
-    return redis_mock
+@dataclass(slots=True)
+class MockTelegramMessage:
+    message_id: int
+    from_user: MockTelegramUser
+    chat: MockTelegramChat
+    text: str = _TEST_MESSAGE_TEXT
+    entities: tuple = _NO_ENTITIES
+    reply_to_message: Any = None
+    date: datetime = _FROZEN_DATE
+    reply_text: AsyncMock = field(default_factory=AsyncMock)
 
 
-# ============================================================================
-# Telegram Fixtures
-# ============================================================================
+@dataclass(slots=True)
+class MockTelegramUpdate:
+    update_id: int
+    message: MockTelegramMessage
+    effective_user: MockTelegramUser
+    effective_chat: MockTelegramChat
+
+
+@dataclass(slots=True)
+class MockTelegramBot:
+    id: int
+    username: str
+    first_name: str
+    send_message: AsyncMock = field(default_factory=AsyncMock)
+
+
+@dataclass(slots=True)
+class MockTelegramContext:
+    bot: MockTelegramBot
+    error: Optional[BaseException] = None
+    user_data: dict = field(default_factory=dict)
+    chat_data: dict = field(default_factory=dict)
+    bot_data: dict = field(default_factory=dict)
+
 
 @pytest.fixture
 def telegram_user():
     """Create mock Telegram user"""
-    user = MagicMock(spec=TelegramUser)
-    user.id = 12345
-    user.username = "test_user"
-    user.first_name = "Test"
-    user.last_name = "User"
-    user.is_bot = False
-    return user
+    return MockTelegramUser(id=12345, username="test_user", first_name="Test", last_name="User")
 
 
 @pytest.fixture
 def telegram_admin_user():
     """Create mock Telegram admin user"""
-    user = MagicMock(spec=TelegramUser)
-    user.id = 99999
-    user.username = "admin_user"
-    user.first_name = "Admin"
-    user.last_name = "User"
-    user.is_bot = False
-    return user
+    return MockTelegramUser(id=99999, username="admin_user", first_name="Admin", last_name="User")
 
 
 @pytest.fixture
 def telegram_chat():
     """Create mock Telegram chat (private)"""
-    chat = MagicMock(spec=Chat)
-    chat.id = 12345
-    chat.type = "private"
-    chat.username = "test_user"
-    return chat
+    return MockTelegramChat(id=12345, type="private", username="test_user")
 
 
 @pytest.fixture
 def telegram_group_chat():
     """Create mock Telegram group chat"""
-    chat = MagicMock(spec=Chat)
-    chat.id = -100123456789
-    chat.type = "supergroup"
-    chat.title = "Test Group"
-    return chat
+    return MockTelegramChat(id=-100123456789, type="supergroup", title="Test Group")
 
 
 @pytest.fixture
 def telegram_message(telegram_user, telegram_chat):
     """Create mock Telegram message"""
-    message = MagicMock(spec=Message)
-    message.message_id = 1
-    message.from_user = telegram_user
-    message.chat = telegram_chat
-    message.text = "Test message"
-    message.entities = []
-    message.reply_to_message = None
-    message.reply_text = AsyncMock()
-    message.date = datetime.utcnow()
-    return message
+    return MockTelegramMessage(message_id=1, from_user=telegram_user, chat=telegram_chat)
 
 
 @pytest.fixture
 def telegram_update(telegram_message, telegram_user):
     """Create mock Telegram update"""
-    update = MagicMock(spec=Update)
-    update.update_id = 1
-    update.message = telegram_message
-    update.effective_user = telegram_user
-    update.effective_chat = telegram_message.chat
-    return update
+    return MockTelegramUpdate(
+        update_id=1,
+        message=telegram_message,
+        effective_user=telegram_user,
+        effective_chat=telegram_message.chat
+    )
 
 
 @pytest.fixture
 def telegram_context():
     """Create mock Telegram context"""
-    context = MagicMock(spec=ContextTypes.DEFAULT_TYPE)
-
-    # Mock bot
-    bot = MagicMock()
-    bot.id = 987654321
-    bot.username = "test_bot"
-    bot.first_name = "TestBot"
-    bot.send_message = AsyncMock()
-
-    context.bot = bot
-    context.user_data = {}
-    context.chat_data = {}
-    context.bot_data = {}
-
-    return context
+    bot = MockTelegramBot(id=987654321, username="test_bot", first_name="TestBot")
+    return MockTelegramContext(bot=bot)
 
 
 # ============================================================================
 # LLM Provider Fixtures
 # ============================================================================
 
+@dataclass(slots=True)
+class MockFunction:
+    name: str
+    arguments: str
+
+
+@dataclass(slots=True)
+class MockToolCall:
+    function: MockFunction
+
+
+@dataclass(slots=True)
+class MockResponse:
+    content: str
+    tool_calls: Optional[list] = None
+
+
+# spec= introspection is comparatively expensive, so spec'd provider/plugin
+# mocks are built once per session. The function-scoped fixtures reset them
+# and reassign every attribute they configure, which also undoes any
+# per-test overrides.
+
+def _reset_shared_mock(mock):
+    """Clear recorded calls, return values and side effects on a shared mock"""
+    mock.reset_mock(return_value=True, side_effect=True)
+    return mock
+
+
+@pytest.fixture(scope="session")
+def _shared_llm_provider():
+    return AsyncMock(spec=BaseLLMProvider)
+
+
 @pytest.fixture
-def mock_llm_provider():
+def mock_llm_provider(_shared_llm_provider):
     """Create mock LLM provider"""
-    provider = AsyncMock(spec=BaseLLMProvider)
+    provider = _reset_shared_mock(_shared_llm_provider)
 
     # Mock simple text response
-    async def mock_generate(messages, **kwargs):
-        return "This is a test response from the LLM"
-
-    # Mock tool call response
-    class MockToolCall:
-        def __init__(self, name, args):
-            self.function = MagicMock()
-            self.function.name = name
-            self.function.arguments = args
-
-    class MockResponseWithTools:
-        def __init__(self):
-            self.content = ""
-            self.tool_calls = [
-                MockToolCall("web_search", '{"query": "test query"}')
-            ]
-
-    provider.generate = AsyncMock(side_effect=mock_generate)
+    provider.generate = AsyncMock(return_value="This is a test response from the LLM")
     provider.health_check = AsyncMock(return_value=True)
 
     return provider
@@ -348,23 +382,6 @@ def mock_llm_provider_with_tools():
     """Create mock LLM provider that returns tool calls"""
     provider = AsyncMock(spec=BaseLLMProvider)
 
-    class MockToolCall:
-        def __init__(self, name, args):
-            self.function = MagicMock()
-            self.function.name = name
-            self.function.arguments = args
-
-    class MockResponse:
-        def __init__(self, with_tools=True):
-            if with_tools:
-                self.content = ""
-                self.tool_calls = [
-                    MockToolCall("web_search", '{"query": "test"}')
-                ]
-            else:
-                self.content = "Final synthesized response"
-                self.tool_calls = None
-
     call_count = 0
 
     async def mock_generate(messages, tools=None, **kwargs):
@@ -373,10 +390,13 @@ def mock_llm_provider_with_tools():
 
         # First call: return tool calls
         if call_count == 1 and tools:
-            return MockResponse(with_tools=True)
+            return MockResponse(
+                content="",
+                tool_calls=[MockToolCall(MockFunction("web_search", '{"query": "test"}'))]
+            )
         # Second call: return final response
         else:
-            return MockResponse(with_tools=False)
+            return MockResponse(content="Final synthesized response")
 
     provider.generate = AsyncMock(side_effect=mock_generate)
     provider.health_check = AsyncMock(return_value=True)
@@ -388,10 +408,33 @@ def mock_llm_provider_with_tools():
 # MCP Fixtures
 # ============================================================================
 
+# Shared, read-only tool schema returned by mock_mcp_plugin.get_tools()
+_MCP_TOOL_LIST = (
+    {
+        "type": "function",
+        "function": {
+            "name": "test_tool",
+            "description": "A test tool",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "query": {"type": "string"}
+                }
+            }
+        }
+    },
+)
+
+
+@pytest.fixture(scope="session")
+def _shared_mcp_plugin():
+    return AsyncMock(spec=BaseMCP)
+
+
 @pytest.fixture
-def mock_mcp_plugin():
+def mock_mcp_plugin(_shared_mcp_plugin):
     """Create mock MCP plugin"""
-    mcp = AsyncMock(spec=BaseMCP)
+    mcp = _reset_shared_mock(_shared_mcp_plugin)
     mcp.name = "test_mcp"
     mcp.enabled = True
     mcp.metadata = {
@@ -400,23 +443,6 @@ def mock_mcp_plugin():
         "version": "1.0.0"
     }
 
-    async def mock_get_tools():
-        return [
-            {
-                "type": "function",
-                "function": {
-                    "name": "test_tool",
-                    "description": "A test tool",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "query": {"type": "string"}
-                        }
-                    }
-                }
-            }
-        ]
-
     async def mock_execute_tool(tool_name, parameters):
         if tool_name == "test_tool":
             return {"result": f"Executed {tool_name} with {parameters}"}
@@ -426,8 +452,9 @@ def mock_mcp_plugin():
         return {"context": f"Context for {query}"}
 
     mcp.initialize = AsyncMock()
-    mcp.get_tools = AsyncMock(side_effect=mock_get_tools)
+    mcp.get_tools = AsyncMock(return_value=_MCP_TOOL_LIST)
     mcp.execute_tool = AsyncMock(side_effect=mock_execute_tool)
+    mcp.can_memoize = MagicMock(return_value=False)
     mcp.get_context = AsyncMock(side_effect=mock_get_context)
     mcp.shutdown = AsyncMock()
 
@@ -442,7 +469,7 @@ def mock_mcp_plugin():
 def test_config(monkeypatch):
     """Override config for testing"""
     # Mock admin IDs
-    monkeypatch.setattr(config.security, 'admin_ids', [99999])
+    monkeypatch.setattr(config.security, 'admin_user_ids', '99999')
 
     # Mock rate limits (more lenient for tests)
     monkeypatch.setattr(config.rate_limit, 'user_requests', 100)
@@ -457,9 +484,13 @@ def test_config(monkeypatch):
 
 def assert_log_contains(caplog, level: str, message: str):
     """Assert that a log message was recorded"""
-    for record in caplog.records:
-        if record.levelname == level and message in record.message:
-            return True
+    # Compare the integer level first; only matching records pay for the substring search
+    levelno = logging.getLevelName(level)
+    if any(
+        record.levelno == levelno and message in record.message
+        for record in caplog.records
+    ):
+        return True
     raise AssertionError(f"Log message not found: [{level}] {message}")
 
 
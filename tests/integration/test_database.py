@@ -1,17 +1,20 @@
 """Integration tests for database operations"""
 
 import pytest
-from datetime import datetime
-from sqlalchemy import select
-from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime, timedelta
+from sqlalchemy import insert, inspect, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 
-from bot.models import User, Session as SessionModel, Message, SystemPrompt
+from bot.database import create_missing_indexes
+from bot.models import Base, User, Session as SessionModel, Message, SystemPrompt, utcnow
 
 
 @pytest.mark.integration
 class TestDatabaseIntegration:
     """Test database models and relationships"""
 
+    @pytest.mark.asyncio
     async def test_create_user(self, test_db_session: AsyncSession):
         """Test creating a user in the database"""
         user = User(
@@ -33,6 +36,23 @@ class TestDatabaseIntegration:
         assert user.username == "testuser"
         assert user.preferences == {"lang": "en"}
 
+    @pytest.mark.asyncio
+    async def test_timestamps_default_to_utc(self, test_db_session: AsyncSession):
+        """Test that timestamps are set in the INSERT itself, in UTC"""
+        # No column DEFAULT: existing tables created from older models lack one
+        assert User.__table__.c.created_at.server_default is None
+        assert str(utcnow().compile(dialect=postgresql.dialect())) == "TIMEZONE('utc', CURRENT_TIMESTAMP)"
+
+        before = datetime.utcnow().replace(microsecond=0)
+        user = User(telegram_id=654321)
+        test_db_session.add(user)
+        await test_db_session.commit()
+        after = datetime.utcnow()
+
+        assert before <= user.created_at <= after
+        assert before <= user.last_active <= after
+
+    @pytest.mark.asyncio
     async def test_create_session_for_user(self, test_db_session: AsyncSession, test_user: User):
         """Test creating a session for a user"""
         session = SessionModel(
@@ -51,6 +71,7 @@ class TestDatabaseIntegration:
         assert session.created_at is not None
         assert session.last_active is not None
 
+    @pytest.mark.asyncio
     async def test_user_session_relationship(self, test_db_session: AsyncSession, test_user: User):
         """Test User -> Sessions relationship"""
         # Create multiple sessions for user
@@ -60,14 +81,13 @@ class TestDatabaseIntegration:
         test_db_session.add_all([session1, session2])
         await test_db_session.commit()
 
-        # Query user with sessions
-        stmt = select(User).where(User.id == test_user.id)
-        result = await test_db_session.execute(stmt)
-        user = result.scalar_one()
+        # Load the relationship in place
+        await test_db_session.refresh(test_user, attribute_names=["sessions"])
 
         # Verify relationship
-        assert len(user.sessions) == 2
+        assert len(test_user.sessions) == 2
 
+    @pytest.mark.asyncio
     async def test_create_message_in_session(self, test_db_session: AsyncSession, test_session: SessionModel):
         """Test creating messages in a session"""
         message = Message(
@@ -88,26 +108,24 @@ class TestDatabaseIntegration:
         assert message.content == "Hello, bot!"
         assert message.tokens == 10
 
+    @pytest.mark.asyncio
     async def test_session_messages_relationship(self, test_db_session: AsyncSession, test_session: SessionModel):
         """Test Session -> Messages relationship"""
-        # Create multiple messages
-        messages = [
-            Message(session_id=test_session.id, role="user", content="Hi"),
-            Message(session_id=test_session.id, role="assistant", content="Hello"),
-            Message(session_id=test_session.id, role="user", content="How are you?"),
-        ]
-
-        test_db_session.add_all(messages)
+        # Create multiple messages with one executemany INSERT
+        await test_db_session.execute(insert(Message), [
+            {"session_id": test_session.id, "role": "user", "content": "Hi"},
+            {"session_id": test_session.id, "role": "assistant", "content": "Hello"},
+            {"session_id": test_session.id, "role": "user", "content": "How are you?"},
+        ])
         await test_db_session.commit()
 
-        # Query session with messages
-        stmt = select(SessionModel).where(SessionModel.id == test_session.id)
-        result = await test_db_session.execute(stmt)
-        session = result.scalar_one()
+        # Load the relationship in place
+        await test_db_session.refresh(test_session, attribute_names=["messages"])
 
         # Verify relationship
-        assert len(session.messages) == 3
+        assert len(test_session.messages) == 3
 
+    @pytest.mark.asyncio
     async def test_create_system_prompt(self, test_db_session: AsyncSession, test_admin_user: User):
         """Test creating a system prompt"""
         prompt = SystemPrompt(
@@ -125,6 +143,7 @@ class TestDatabaseIntegration:
         assert prompt.set_by_user_id == test_admin_user.id
         assert prompt.is_active is True
 
+    @pytest.mark.asyncio
     async def test_only_one_active_system_prompt(self, test_db_session: AsyncSession, test_admin_user: User):
         """Test that only one system prompt can be active at a time"""
         # Create first prompt
@@ -134,9 +153,9 @@ class TestDatabaseIntegration:
             is_active=True
         )
         test_db_session.add(prompt1)
-        await test_db_session.commit()
+        await test_db_session.flush()
 
-        # Create second prompt and deactivate first
+        # Create second prompt and deactivate first, all in one transaction
         from sqlalchemy import update
         await test_db_session.execute(
             update(SystemPrompt)
@@ -160,19 +179,19 @@ class TestDatabaseIntegration:
         assert len(active_prompts) == 1
         assert active_prompts[0].prompt == "Second prompt"
 
+    @pytest.mark.asyncio
     async def test_message_ordering_by_created_at(self, test_db_session: AsyncSession, test_session: SessionModel):
         """Test that messages are ordered by created_at"""
-        # Create messages
-        msg1 = Message(session_id=test_session.id, role="user", content="First")
-        test_db_session.add(msg1)
-        await test_db_session.commit()
-
-        msg2 = Message(session_id=test_session.id, role="assistant", content="Second")
-        test_db_session.add(msg2)
-        await test_db_session.commit()
-
-        msg3 = Message(session_id=test_session.id, role="user", content="Third")
-        test_db_session.add(msg3)
+        # Create messages in one flush with explicit, strictly increasing timestamps
+        t0 = datetime.utcnow()
+        test_db_session.add_all([
+            Message(session_id=test_session.id, role="assistant", content="Second",
+                    created_at=t0 + timedelta(microseconds=1)),
+            Message(session_id=test_session.id, role="user", content="Third",
+                    created_at=t0 + timedelta(microseconds=2)),
+            Message(session_id=test_session.id, role="user", content="First",
+                    created_at=t0),
+        ])
         await test_db_session.commit()
 
         # Query messages ordered by created_at
@@ -185,18 +204,21 @@ class TestDatabaseIntegration:
         assert messages[1].content == "Second"
         assert messages[2].content == "Third"
 
+    @pytest.mark.asyncio
     async def test_cascade_delete_session_deletes_messages(self, test_db_session: AsyncSession, test_user: User):
         """Test that deleting a session cascades to delete messages"""
         # Create session with messages
-        session = SessionModel(user_id=test_user.id, active_mcps=[])
+        session = SessionModel(
+            user_id=test_user.id,
+            active_mcps=[],
+            messages=[
+                Message(role="user", content="Test"),
+                Message(role="assistant", content="Response"),
+            ]
+        )
         test_db_session.add(session)
         await test_db_session.commit()
 
-        msg1 = Message(session_id=session.id, role="user", content="Test")
-        msg2 = Message(session_id=session.id, role="assistant", content="Response")
-        test_db_session.add_all([msg1, msg2])
-        await test_db_session.commit()
-
         session_id = session.id
 
         # Delete session
@@ -210,6 +232,7 @@ class TestDatabaseIntegration:
 
         assert len(messages) == 0
 
+    @pytest.mark.asyncio
     async def test_user_unique_telegram_id(self, test_db_session: AsyncSession):
         """Test that telegram_id must be unique"""
         user1 = User(telegram_id=999, username="user1", is_admin=False, is_blocked=False)
@@ -223,8 +246,9 @@ class TestDatabaseIntegration:
         with pytest.raises(Exception):  # Should raise integrity error
             await test_db_session.commit()
 
-    async def test_user_preferences_json_storage(self, test_db_session: AsyncSession):
-        """Test that user preferences are stored as JSON"""
+    @pytest.mark.asyncio
+    async def test_json_columns_round_trip(self, test_db_session: AsyncSession):
+        """Test that user preferences, session metadata and message metadata are stored as JSON"""
         user = User(
             telegram_id=888,
             username="jsonuser",
@@ -237,19 +261,8 @@ class TestDatabaseIntegration:
                 "nested": {"key": "value"}
             }
         )
-
-        test_db_session.add(user)
-        await test_db_session.commit()
-        await test_db_session.refresh(user)
-
-        assert user.preferences["language"] == "ru"
-        assert user.preferences["notifications"] is True
-        assert user.preferences["nested"]["key"] == "value"
-
-    async def test_session_metadata_json_storage(self, test_db_session: AsyncSession, test_user: User):
-        """Test that session metadata is stored as JSON"""
         session = SessionModel(
-            user_id=test_user.id,
+            user=user,
             active_mcps=["web"],
             session_metadata={
                 "start_time": "2024-01-01T00:00:00",
@@ -257,19 +270,8 @@ class TestDatabaseIntegration:
                 "flags": [1, 2, 3]
             }
         )
-
-        test_db_session.add(session)
-        await test_db_session.commit()
-        await test_db_session.refresh(session)
-
-        assert session.session_metadata["start_time"] == "2024-01-01T00:00:00"
-        assert session.session_metadata["context"]["key"] == "value"
-        assert session.session_metadata["flags"] == [1, 2, 3]
-
-    async def test_message_metadata_json_storage(self, test_db_session: AsyncSession, test_session: SessionModel):
-        """Test that message metadata is stored as JSON"""
         message = Message(
-            session_id=test_session.id,
+            session=session,
             role="assistant",
             content="Test response",
             message_metadata={
@@ -279,19 +281,34 @@ class TestDatabaseIntegration:
             }
         )
 
-        test_db_session.add(message)
+        test_db_session.add_all([user, session, message])
         await test_db_session.commit()
-        await test_db_session.refresh(message)
 
-        assert message.message_metadata["tool_called"] is True
-        assert message.message_metadata["tools"] == ["web_search", "news"]
-        assert message.message_metadata["response_time"] == 1.5
+        # Read all three columns back from the database in one query
+        stmt = (
+            select(User.preferences, SessionModel.session_metadata, Message.message_metadata)
+            .join(SessionModel, SessionModel.user_id == User.id)
+            .join(Message, Message.session_id == SessionModel.id)
+            .where(Message.id == message.id)
+        )
+        preferences, session_metadata, message_metadata = (await test_db_session.execute(stmt)).one()
+
+        assert preferences["language"] == "ru"
+        assert preferences["notifications"] is True
+        assert preferences["nested"]["key"] == "value"
 
+        assert session_metadata["start_time"] == "2024-01-01T00:00:00"
+        assert session_metadata["context"]["key"] == "value"
+        assert session_metadata["flags"] == [1, 2, 3]
+
+        assert message_metadata["tool_called"] is True
+        assert message_metadata["tools"] == ["web_search", "news"]
+        assert message_metadata["response_time"] == 1.5
+
+    @pytest.mark.asyncio
     async def test_query_recent_active_sessions(self, test_db_session: AsyncSession, test_user: User):
         """Test querying sessions by last_active timestamp"""
         # Create sessions with different last_active times
-        from datetime import datetime, timedelta
-
         old_session = SessionModel(
             user_id=test_user.id,
             active_mcps=[],
@@ -319,19 +336,18 @@ class TestDatabaseIntegration:
         assert len(recent_sessions) == 1
         assert recent_sessions[0].id == recent_session.id
 
+    @pytest.mark.asyncio
     async def test_count_messages_by_role(self, test_db_session: AsyncSession, test_session: SessionModel):
         """Test counting messages by role"""
         from sqlalchemy import func
 
-        # Create messages with different roles
-        messages = [
-            Message(session_id=test_session.id, role="user", content="1"),
-            Message(session_id=test_session.id, role="user", content="2"),
-            Message(session_id=test_session.id, role="assistant", content="3"),
-            Message(session_id=test_session.id, role="system", content="4"),
-        ]
-
-        test_db_session.add_all(messages)
+        # Create messages with different roles with one executemany INSERT
+        await test_db_session.execute(insert(Message), [
+            {"session_id": test_session.id, "role": "user", "content": "1"},
+            {"session_id": test_session.id, "role": "user", "content": "2"},
+            {"session_id": test_session.id, "role": "assistant", "content": "3"},
+            {"session_id": test_session.id, "role": "system", "content": "4"},
+        ])
         await test_db_session.commit()
 
         # Count user messages
@@ -343,3 +359,28 @@ class TestDatabaseIntegration:
         user_count = result.scalar()
 
         assert user_count == 2
+
+    @pytest.mark.asyncio
+    async def test_create_missing_indexes_on_existing_tables(self):
+        """Test that indexes added after the tables were created get built"""
+        engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+        try:
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+                # Simulate a database created before the indexes existed
+                await conn.exec_driver_sql("DROP INDEX ix_messages_session_id")
+                await conn.exec_driver_sql("DROP INDEX ix_sessions_user_last_active")
+
+                # create_all alone leaves existing tables untouched
+                await conn.run_sync(Base.metadata.create_all)
+                await conn.run_sync(create_missing_indexes)
+                # Idempotent on later startups
+                await conn.run_sync(create_missing_indexes)
+
+                def index_names(sync_conn, table):
+                    return {index["name"] for index in inspect(sync_conn).get_indexes(table)}
+
+                assert "ix_messages_session_id" in await conn.run_sync(index_names, "messages")
+                assert "ix_sessions_user_last_active" in await conn.run_sync(index_names, "sessions")
+        finally:
+            await engine.dispose()
@@ -2,51 +2,168 @@
 
 import pytest
 import json
-from unittest.mock import AsyncMock, MagicMock, patch
+from dataclasses import dataclass
+from unittest.mock import MagicMock, patch
+from structlog.testing import capture_logs
 from telegram import Message as TelegramMessage
 
-from bot.handlers import BotHandlers
+from bot.handlers import BotHandlers, escape_markdown_v2
 from bot.session import SessionManager
 from bot.llm.service import LLMService
 from bot.mcp.manager import MCPManager
 from bot.rate_limiter import RateLimiter
 
 
-@pytest.mark.unit
-class TestBotHandlers:
-    """Test BotHandlers functionality"""
+@dataclass(slots=True)
+class _Function:
+    name: str
+    arguments: str
+
+
+@dataclass(slots=True)
+class _ToolCall:
+    function: _Function
+
+
+# Commands /help should only list for admins
+_ADMIN_COMMANDS = ("/get_system_prompt", "/set_system_prompt")
+
+# Arguments shared by every tool call in these tests, encoded once
+_QUERY_TEST_ARGS = json.dumps({"query": "test"})
+
+
+def _tool_call(name, args=_QUERY_TEST_ARGS):
+    """Build an OpenAI-style tool call; dict arguments are JSON-encoded"""
+    if not isinstance(args, str):
+        args = json.dumps(args)
+    return _ToolCall(_Function(name, args))
+
+
+class _AsyncRecorder:
+    """Minimal AsyncMock stand-in that records calls
+
+    AsyncMock is expensive to build, and these stubs only need a canned
+    result (or exception) plus the call list.
+    """
 
-    @pytest.fixture
-    async def bot_handlers(self, test_db_session, mock_redis, mock_llm_provider, test_config):
-        """Create BotHandlers with mocked dependencies"""
-        with patch('bot.session.aioredis.from_url', return_value=mock_redis), \
-             patch('bot.rate_limiter.aioredis.from_url', return_value=mock_redis):
+    __slots__ = ("return_value", "side_effect", "calls")
 
-            session_manager = SessionManager(test_db_session)
-            session_manager._redis = mock_redis
+    def __init__(self, return_value=None, side_effect=None):
+        self.return_value = return_value
+        self.side_effect = side_effect
+        self.calls = []
 
-            llm_service = LLMService(provider=mock_llm_provider)
-            mcp_manager = MCPManager()
+    async def __call__(self, *args, **kwargs):
+        self.calls.append((args, kwargs))
+        if self.side_effect is not None:
+            raise self.side_effect
+        return self.return_value
 
-            rate_limiter = RateLimiter()
-            rate_limiter._redis = mock_redis
+    @property
+    def called(self):
+        return bool(self.calls)
 
-            handlers = BotHandlers(
-                session_manager=session_manager,
-                llm_service=llm_service,
-                mcp_manager=mcp_manager,
-                rate_limiter=rate_limiter
-            )
+    def assert_called_once(self):
+        assert len(self.calls) == 1, f"Expected stub to be called once, called {len(self.calls)} times"
 
-            yield handlers
 
-            await session_manager.close()
-            await rate_limiter.close()
+def _assert_token_consumed(handlers, update):
+    handlers.rate_limiter.check_and_consume.assert_called_once()
+
+
+def _assert_llm_called(handlers, update):
+    handlers.llm_service.provider.generate.assert_called()
+
+
+def _assert_prefix_stripped(handlers, update):
+    """The LLM should receive the user message without the [assistant] prefix"""
+    messages = handlers.llm_service.provider.generate.call_args.kwargs['messages']
+    user_message = next(
+        (msg for msg in messages if msg["role"] == "user" and "Hello there" in msg["content"]),
+        None
+    )
+    assert user_message is not None
+    assert "[assistant]" not in user_message["content"]
+
+
+def _assert_llm_response_sent(handlers, update):
+    """The user should be answered with the LLM's response"""
+    reply = update.message.reply_text.call_args[0][0]
+    assert "Answer from the model" in reply
+
+
+def _assert_empty_fallback(handlers, update):
+    """An empty LLM response should be answered with the fallback message"""
+    reply = update.message.reply_text.call_args[0][0]
+    assert "пустой ответ" in reply.lower()
+
+
+@pytest.mark.unit
+class TestBotHandlers:
+    """Test BotHandlers functionality"""
+
+    @pytest.fixture(scope="module")
+    def bot_handlers(self, request, _shared_fake_redis):
+        """Build the BotHandlers graph once per module
+
+        Per-test dependencies (db session, redis, LLM provider) are attached
+        by ``_reset_bot_handlers`` below. The handlers also build their own
+        SessionManager per request, so the shared pool is pointed at fakeredis.
+        """
+        for target in ('bot.session.get_pool', 'bot.rate_limiter.get_pool'):
+            patcher = patch(target, return_value=_shared_fake_redis.connection_pool)
+            patcher.start()
+            request.addfinalizer(patcher.stop)
+
+        return BotHandlers(
+            session_manager=SessionManager(None),
+            llm_service=LLMService(provider=None),
+            mcp_manager=MCPManager(),
+            rate_limiter=RateLimiter()
+        )
+
+    @pytest.fixture(autouse=True)
+    def _reset_bot_handlers(self, bot_handlers, test_db_session, mock_redis, mock_llm_provider):
+        """Rewire the shared handlers to this test's fixtures and clear state"""
+        bot_handlers._waiting_for_prompt.clear()
+
+        bot_handlers.session_manager.db = test_db_session
+        bot_handlers.session_manager._redis = mock_redis
+        bot_handlers.session_manager._touched.clear()
+        bot_handlers.session_manager._user_cache.clear()
+
+        bot_handlers.llm_service.provider = mock_llm_provider
+        bot_handlers.llm_service.custom_system_prompt = None
+
+        bot_handlers.mcp_manager.mcps.clear()
+        bot_handlers.mcp_manager.tool_registry.clear()
+        bot_handlers.mcp_manager.clear_memo_cache()
+        # Drop instance-level overrides left behind by earlier tests
+        vars(bot_handlers.mcp_manager).pop("execute_tool", None)
+
+        bot_handlers.rate_limiter._redis = mock_redis
+        bot_handlers.rate_limiter._check_and_consume_script = None
+        bot_handlers.rate_limiter.check_and_consume = _AsyncRecorder(return_value=(True, None))
+
+    @pytest.fixture(autouse=True)
+    def _stub_session_factory(self, monkeypatch, bot_handlers):
+        """Hand the handlers the test's db session instead of opening a new one"""
+        class _Ctx:
+            async def __aenter__(self_):
+                return bot_handlers.session_manager.db
+
+            async def __aexit__(self_, *exc_info):
+                return False
+
+        ctx = _Ctx()
+        # handlers.py imports the factory lazily from bot.database
+        monkeypatch.setattr('bot.database.async_session_factory', lambda: ctx)
 
     # =========================================================================
     # Command Handlers Tests
     # =========================================================================
 
+    @pytest.mark.asyncio
     async def test_start_command_sends_welcome_message(self, bot_handlers, telegram_update):
         """Test that /start command sends welcome message"""
         await bot_handlers.start_command(telegram_update, None)
@@ -55,6 +172,7 @@ class TestBotHandlers:
         call_args = telegram_update.message.reply_text.call_args
         assert "Привет" in call_args[0][0]
 
+    @pytest.mark.asyncio
     async def test_help_command_shows_commands(self, bot_handlers, telegram_update):
         """Test that /help command shows available commands"""
         await bot_handlers.help_command(telegram_update, None)
@@ -65,84 +183,63 @@ class TestBotHandlers:
         assert "/help" in call_args[0][0]
         assert "/reset" in call_args[0][0]
 
-    async def test_help_command_shows_admin_commands_for_admin(self, bot_handlers, telegram_update, telegram_admin_user, test_config):
-        """Test that /help shows admin commands for admin users"""
-        telegram_update.effective_user = telegram_admin_user
+    @pytest.mark.parametrize("user_fixture,admin_visible", [
+        ("telegram_user", False),
+        ("telegram_admin_user", True),
+    ], ids=["user", "admin"])
+    @pytest.mark.asyncio
+    async def test_help_command_admin_commands_visibility(self, bot_handlers, telegram_update, request, user_fixture, admin_visible):
+        """Test that /help lists admin commands only for admin users"""
+        if admin_visible:
+            request.getfixturevalue("test_config")
+        telegram_update.effective_user = request.getfixturevalue(user_fixture)
 
         await bot_handlers.help_command(telegram_update, None)
 
         call_args = telegram_update.message.reply_text.call_args
-        assert "/get_system_prompt" in call_args[0][0]
-        assert "/set_system_prompt" in call_args[0][0]
-
-    async def test_help_command_hides_admin_commands_for_regular_user(self, bot_handlers, telegram_update):
-        """Test that /help hides admin commands for regular users"""
-        await bot_handlers.help_command(telegram_update, None)
-
-        call_args = telegram_update.message.reply_text.call_args
-        assert "/get_system_prompt" not in call_args[0][0]
-        assert "/set_system_prompt" not in call_args[0][0]
+        for command in _ADMIN_COMMANDS:
+            assert (command in call_args[0][0]) is admin_visible
 
+    @pytest.mark.asyncio
     async def test_reset_command_clears_session(self, bot_handlers, telegram_update, test_user, test_session, test_messages):
         """Test that /reset command clears conversation history"""
-        with patch('bot.handlers.async_session_factory') as mock_factory:
-            mock_factory.return_value.__aenter__.return_value = bot_handlers.session_manager.db
-
-            await bot_handlers.reset_command(telegram_update, None)
-
-            telegram_update.message.reply_text.assert_called_once()
-            assert "очищена" in telegram_update.message.reply_text.call_args[0][0]
-
-    async def test_get_system_prompt_denied_for_non_admin(self, bot_handlers, telegram_update, telegram_user):
-        """Test that /get_system_prompt is denied for non-admin users"""
-        telegram_update.effective_user = telegram_user
-
-        await bot_handlers.get_system_prompt_command(telegram_update, None)
-
-        call_args = telegram_update.message.reply_text.call_args
-        assert "администраторам" in call_args[0][0]
-
-    async def test_get_system_prompt_shows_prompt_for_admin(self, bot_handlers, telegram_update, telegram_admin_user, test_config):
-        """Test that /get_system_prompt shows prompt for admin users"""
-        telegram_update.effective_user = telegram_admin_user
-
-        await bot_handlers.get_system_prompt_command(telegram_update, None)
+        await bot_handlers.reset_command(telegram_update, None)
 
-        call_args = telegram_update.message.reply_text.call_args
-        assert "Текущий системный промпт" in call_args[0][0]
-
-    async def test_set_system_prompt_denied_for_non_admin(self, bot_handlers, telegram_update, telegram_user):
-        """Test that /set_system_prompt is denied for non-admin users"""
-        telegram_update.effective_user = telegram_user
-
-        await bot_handlers.set_system_prompt_command(telegram_update, None)
-
-        call_args = telegram_update.message.reply_text.call_args
-        assert "администраторам" in call_args[0][0]
-
-    async def test_set_system_prompt_waits_for_input_from_admin(self, bot_handlers, telegram_update, telegram_admin_user, test_config):
-        """Test that /set_system_prompt prompts admin for new prompt"""
-        telegram_update.effective_user = telegram_admin_user
-
-        await bot_handlers.set_system_prompt_command(telegram_update, None)
+        telegram_update.message.reply_text.assert_called_once()
+        assert "очищена" in telegram_update.message.reply_text.call_args[0][0]
+
+    @pytest.mark.parametrize("cmd_attr,user_fixture,expect_substr,waits_for_prompt", [
+        ("get_system_prompt_command", "telegram_user", "администраторам", False),
+        ("get_system_prompt_command", "telegram_admin_user", "Текущий системный промпт", False),
+        ("set_system_prompt_command", "telegram_user", "администраторам", False),
+        # Puts the chat into the handlers' waiting-for-prompt state
+        pytest.param("set_system_prompt_command", "telegram_admin_user", "отправьте новый системный промпт", True,
+                     marks=pytest.mark.serial),
+    ], ids=["get-user", "get-admin", "set-user", "set-admin"])
+    @pytest.mark.asyncio
+    async def test_admin_command(self, bot_handlers, telegram_update, request, cmd_attr, user_fixture, expect_substr, waits_for_prompt):
+        """Test that system prompt commands are admin-only"""
+        if user_fixture == "telegram_admin_user":
+            request.getfixturevalue("test_config")
+        telegram_update.effective_user = request.getfixturevalue(user_fixture)
+
+        await getattr(bot_handlers, cmd_attr)(telegram_update, None)
 
         call_args = telegram_update.message.reply_text.call_args
-        assert "отправьте новый системный промпт" in call_args[0][0]
+        assert expect_substr in call_args[0][0]
 
-        # Verify waiting state was set
-        assert telegram_update.message.chat.id in bot_handlers._waiting_for_prompt
+        # Only /set_system_prompt from an admin enters the waiting state
+        assert (telegram_update.message.chat.id in bot_handlers._waiting_for_prompt) is waits_for_prompt
 
     # =========================================================================
     # Message Handler Tests
     # =========================================================================
 
+    @pytest.mark.asyncio
     async def test_handle_message_blocks_rate_limited_user(self, bot_handlers, telegram_update, mock_redis):
         """Test that rate-limited users are blocked"""
-        # Mock rate limit exceeded
-        async def mock_check_limit(user_id):
-            return False, 30  # Not allowed, retry after 30s
-
-        bot_handlers.rate_limiter.check_limit = AsyncMock(side_effect=mock_check_limit)
+        # Mock rate limit exceeded: not allowed, retry after 30s
+        bot_handlers.rate_limiter.check_and_consume = _AsyncRecorder(return_value=(False, 30))
 
         await bot_handlers.handle_message(telegram_update, None)
 
@@ -151,166 +248,71 @@ class TestBotHandlers:
         assert "Rate limit" in call_args[0][0]
         assert "30" in call_args[0][0]
 
-    async def test_handle_message_processes_allowed_request(self, bot_handlers, telegram_update, mock_redis, test_user):
-        """Test that allowed requests are processed"""
-        # Mock rate limit allowed
-        bot_handlers.rate_limiter.check_limit = AsyncMock(return_value=(True, None))
-        bot_handlers.rate_limiter.consume_token = AsyncMock()
-
-        with patch('bot.handlers.async_session_factory') as mock_factory:
-            mock_factory.return_value.__aenter__.return_value = bot_handlers.session_manager.db
-
-            await bot_handlers.handle_message(telegram_update, None)
-
-            # Should consume rate limit token
-            bot_handlers.rate_limiter.consume_token.assert_called_once()
-
-    async def test_handle_message_saves_user_message(self, bot_handlers, telegram_update, test_user):
-        """Test that user message is saved to database"""
-        bot_handlers.rate_limiter.check_limit = AsyncMock(return_value=(True, None))
-        bot_handlers.rate_limiter.consume_token = AsyncMock()
-
-        with patch('bot.handlers.async_session_factory') as mock_factory:
-            mock_factory.return_value.__aenter__.return_value = bot_handlers.session_manager.db
-
-            telegram_update.message.text = "Hello bot!"
-
-            await bot_handlers.handle_message(telegram_update, None)
-
-            # Verify LLM was called
-            bot_handlers.llm_service.provider.generate.assert_called()
-
-    async def test_handle_message_sends_llm_response(self, bot_handlers, telegram_update, test_user):
-        """Test that LLM response is sent to user"""
-        bot_handlers.rate_limiter.check_limit = AsyncMock(return_value=(True, None))
-        bot_handlers.rate_limiter.consume_token = AsyncMock()
-
-        with patch('bot.handlers.async_session_factory') as mock_factory:
-            mock_factory.return_value.__aenter__.return_value = bot_handlers.session_manager.db
-
-            await bot_handlers.handle_message(telegram_update, None)
-
-            # Should reply with LLM response
-            telegram_update.message.reply_text.assert_called()
-
-    async def test_handle_message_in_group_ignores_non_mentions(self, bot_handlers, telegram_update, telegram_group_chat):
-        """Test that bot ignores messages in groups unless mentioned"""
-        telegram_update.message.chat = telegram_group_chat
-        telegram_update.message.text = "Hello everyone"
-
-        bot_handlers.rate_limiter.check_limit = AsyncMock(return_value=(True, None))
+    @pytest.mark.parametrize("text,llm_return,check", [
+        ("Hello bot!", None, _assert_token_consumed),
+        ("Hello bot!", None, _assert_llm_called),
+        ("Hello bot!", "Answer from the model", _assert_llm_response_sent),
+        ("[assistant] Hello there", None, _assert_prefix_stripped),
+        ("Hello bot!", "", _assert_empty_fallback),
+    ], ids=["consumes-token", "calls-llm", "sends-response", "strips-prefix", "empty-response"])
+    @pytest.mark.asyncio
+    async def test_handle_message_variants(self, bot_handlers, telegram_update, test_user, text, llm_return, check):
+        """Test the private-chat message path through rate limiting, LLM and reply"""
+        telegram_update.message.text = text
+        if llm_return is not None:
+            bot_handlers.llm_service.provider.generate.return_value = llm_return
 
         await bot_handlers.handle_message(telegram_update, None)
 
-        # Should not process the message (no reply, no rate limit consumed)
-        telegram_update.message.reply_text.assert_not_called()
-        bot_handlers.rate_limiter.consume_token.assert_not_called()
-
-    async def test_handle_message_in_group_responds_to_mention(self, bot_handlers, telegram_update, telegram_group_chat, telegram_context, test_user):
-        """Test that bot responds to mentions in groups"""
-        telegram_update.message.chat = telegram_group_chat
-        telegram_update.message.text = "@test_bot Hello"
-
-        bot_handlers.rate_limiter.check_limit = AsyncMock(return_value=(True, None))
-        bot_handlers.rate_limiter.consume_token = AsyncMock()
-
-        with patch('bot.handlers.async_session_factory') as mock_factory:
-            mock_factory.return_value.__aenter__.return_value = bot_handlers.session_manager.db
-
-            await bot_handlers.handle_message(telegram_update, telegram_context)
-
-            # Should process the message
-            bot_handlers.rate_limiter.consume_token.assert_called()
+        check(bot_handlers, telegram_update)
 
-    async def test_handle_message_in_group_responds_to_reply(self, bot_handlers, telegram_update, telegram_group_chat, telegram_context, test_user):
-        """Test that bot responds to replies in groups"""
+    @pytest.mark.parametrize("text,reply_to_bot,expect_processed", [
+        ("Hello everyone", False, False),
+        ("@test_bot Hello", False, True),
+        ("Sure, thanks!", True, True),
+    ], ids=["plain", "mention", "reply"])
+    @pytest.mark.asyncio
+    async def test_handle_message_group_routing(self, bot_handlers, telegram_update, telegram_group_chat, telegram_context, test_user, text, reply_to_bot, expect_processed):
+        """Test that bot only responds in groups when mentioned or replied to"""
         telegram_update.message.chat = telegram_group_chat
-        telegram_update.message.text = "Sure, thanks!"
-
-        # Create mock reply_to_message
-        reply_msg = MagicMock()
-        reply_msg.from_user = MagicMock()
-        reply_msg.from_user.id = telegram_context.bot.id  # Reply to bot
-        telegram_update.message.reply_to_message = reply_msg
-
-        bot_handlers.rate_limiter.check_limit = AsyncMock(return_value=(True, None))
-        bot_handlers.rate_limiter.consume_token = AsyncMock()
-
-        with patch('bot.handlers.async_session_factory') as mock_factory:
-            mock_factory.return_value.__aenter__.return_value = bot_handlers.session_manager.db
-
-            await bot_handlers.handle_message(telegram_update, telegram_context)
-
-            # Should process the message
-            bot_handlers.rate_limiter.consume_token.assert_called()
-
-    async def test_handle_tool_calls_executes_tools(self, bot_handlers, mock_mcp_plugin):
-        """Test that _handle_tool_calls executes MCP tools"""
-        await bot_handlers.mcp_manager.register_mcp(mock_mcp_plugin)
-
-        # Create mock tool calls
-        class MockToolCall:
-            def __init__(self, name, args):
-                self.function = MagicMock()
-                self.function.name = name
-                self.function.arguments = json.dumps(args)
-
-        tool_calls = [
-            MockToolCall("test_tool", {"query": "test"})
-        ]
-
-        results, websearch_called = await bot_handlers._handle_tool_calls(tool_calls)
-
-        assert len(results) == 1
-        assert results[0]["tool_name"] == "test_tool"
-        assert "result" in results[0]
-
-    async def test_handle_tool_calls_tracks_web_search(self, bot_handlers, mock_mcp_plugin):
-        """Test that _handle_tool_calls tracks web_search calls"""
-        # Create web search tool
-        class MockToolCall:
-            def __init__(self, name, args):
-                self.function = MagicMock()
-                self.function.name = name
-                self.function.arguments = json.dumps(args)
-
-        tool_calls = [
-            MockToolCall("web_search", {"query": "test"})
-        ]
-
-        # Mock the execute_tool to avoid actual execution
-        bot_handlers.mcp_manager.execute_tool = AsyncMock(return_value={"results": []})
-
-        results, websearch_called = await bot_handlers._handle_tool_calls(tool_calls)
-
-        assert websearch_called is True
-
-    async def test_handle_tool_calls_handles_errors_gracefully(self, bot_handlers, mock_mcp_plugin):
-        """Test that _handle_tool_calls handles tool errors gracefully"""
+        telegram_update.message.text = text
+
+        if reply_to_bot:
+            reply_msg = MagicMock()
+            reply_msg.from_user.id = telegram_context.bot.id
+            telegram_update.message.reply_to_message = reply_msg
+
+        await bot_handlers.handle_message(telegram_update, telegram_context)
+
+        # Ignored messages get no reply and consume no rate limit token
+        assert bot_handlers.rate_limiter.check_and_consume.called is expect_processed
+        if not expect_processed:
+            telegram_update.message.reply_text.assert_not_called()
+
+    @pytest.mark.parametrize("tool_name,execute_stub,check", [
+        ("test_tool", None,
+         lambda results, websearch: results[0]["tool_name"] == "test_tool" and "result" in results[0]),
+        ("web_search", {"return_value": {"results": []}},
+         lambda results, websearch: websearch is True),
+        ("test_tool", {"side_effect": Exception("Tool failed")},
+         lambda results, websearch: "Error" in results[0]["result"]),
+    ], ids=["executes", "tracks-web-search", "handles-errors"])
+    @pytest.mark.asyncio
+    async def test_handle_tool_calls(self, bot_handlers, mock_mcp_plugin, tool_name, execute_stub, check):
+        """Test that _handle_tool_calls executes tools, tracks web search and survives errors"""
         await bot_handlers.mcp_manager.register_mcp(mock_mcp_plugin)
+        if execute_stub is not None:
+            bot_handlers.mcp_manager.execute_tool = _AsyncRecorder(**execute_stub)
 
-        # Mock tool to raise error
-        bot_handlers.mcp_manager.execute_tool = AsyncMock(side_effect=Exception("Tool failed"))
-
-        class MockToolCall:
-            def __init__(self, name, args):
-                self.function = MagicMock()
-                self.function.name = name
-                self.function.arguments = json.dumps(args)
-
-        tool_calls = [
-            MockToolCall("test_tool", {"query": "test"})
-        ]
-
-        results, _ = await bot_handlers._handle_tool_calls(tool_calls)
+        results, websearch_called = await bot_handlers._handle_tool_calls([
+            _tool_call(tool_name)
+        ])
 
         assert len(results) == 1
-        assert "Error" in results[0]["result"]
+        assert check(results, websearch_called)
 
-    async def test_escape_markdown_v2_escapes_special_chars(self):
+    def test_escape_markdown_v2_escapes_special_chars(self):
         """Test that escape_markdown_v2 escapes special characters"""
-        from bot.handlers import escape_markdown_v2
-
         text = "Test_with*special[chars]"
         escaped = escape_markdown_v2(text)
 
@@ -318,56 +320,15 @@ class TestBotHandlers:
         assert r"\*" in escaped
         assert r"\[" in escaped
 
-    async def test_error_handler_logs_errors(self, bot_handlers, telegram_update, caplog):
+    @pytest.mark.asyncio
+    async def test_error_handler_logs_errors(self, bot_handlers, telegram_update, telegram_context):
         """Test that error_handler logs errors properly"""
-        error = Exception("Test error")
-
-        context = MagicMock()
-        context.error = error
-
-        await bot_handlers.error_handler(telegram_update, context)
-
-        # Should log the error (check caplog if needed)
-
-    async def test_handle_message_cleans_assistant_prefix(self, bot_handlers, telegram_update, test_user):
-        """Test that [assistant] prefix is stripped from messages"""
-        bot_handlers.rate_limiter.check_limit = AsyncMock(return_value=(True, None))
-        bot_handlers.rate_limiter.consume_token = AsyncMock()
-
-        telegram_update.message.text = "[assistant] Hello there"
-
-        with patch('bot.handlers.async_session_factory') as mock_factory:
-            mock_factory.return_value.__aenter__.return_value = bot_handlers.session_manager.db
-
-            await bot_handlers.handle_message(telegram_update, None)
-
-            # LLM should receive cleaned message
-            call_args = bot_handlers.llm_service.provider.generate.call_args
-            messages = call_args.kwargs['messages']
-
-            # Find user message
-            user_message = None
-            for msg in messages:
-                if msg["role"] == "user" and "Hello there" in msg["content"]:
-                    user_message = msg
-                    break
-
-            assert user_message is not None
-            assert "[assistant]" not in user_message["content"]
-
-    async def test_handle_message_handles_empty_response(self, bot_handlers, telegram_update, test_user):
-        """Test that handle_message handles empty LLM responses"""
-        bot_handlers.rate_limiter.check_limit = AsyncMock(return_value=(True, None))
-        bot_handlers.rate_limiter.consume_token = AsyncMock()
-
-        # Mock LLM to return empty response
-        bot_handlers.llm_service.provider.generate = AsyncMock(return_value="")
-
-        with patch('bot.handlers.async_session_factory') as mock_factory:
-            mock_factory.return_value.__aenter__.return_value = bot_handlers.session_manager.db
+        telegram_context.error = Exception("Test error")
 
-            await bot_handlers.handle_message(telegram_update, None)
+        with capture_logs() as logs:
+            await bot_handlers.error_handler(telegram_update, telegram_context)
 
-            # Should send fallback message
-            call_args = telegram_update.message.reply_text.call_args
-            assert "пустой ответ" in call_args[0][0].lower() or call_args[0][0] != ""
+        assert len(logs) == 1
+        assert logs[0]["log_level"] == "error"
+        assert "Test error" in logs[0]["event"]
+        assert logs[0]["exc_info"] is telegram_context.error
@@ -1,7 +1,6 @@
 """Unit tests for LLMService"""
 
 import pytest
-from unittest.mock import AsyncMock, MagicMock
 
 from bot.llm.service import LLMService
 from bot.llm.base import BaseLLMProvider
@@ -11,43 +10,24 @@ from bot.llm.base import BaseLLMProvider
 class TestLLMService:
     """Test LLMService functionality"""
 
-    @pytest.fixture
-    def llm_service(self, mock_llm_provider):
-        """Create LLM service with mocked provider"""
-        return LLMService(provider=mock_llm_provider)
+    @pytest.fixture(scope="module")
+    def llm_service(self, _shared_llm_provider):
+        """Create LLM service once per module around the shared mock provider"""
+        return LLMService(provider=_shared_llm_provider)
 
-    async def test_process_message_calls_provider_generate(self, llm_service, mock_llm_provider):
-        """Test that process_message calls provider.generate()"""
+    @pytest.fixture(autouse=True)
+    def _reset_llm_service(self, llm_service, mock_llm_provider):
+        """Clear per-test state; mock_llm_provider resets the shared provider"""
+        llm_service.provider = mock_llm_provider
+        llm_service.custom_system_prompt = None
+
+    @pytest.mark.asyncio
+    async def test_process_message_builds_messages(self, llm_service, mock_llm_provider):
+        """Test the message array and arguments process_message hands to the provider"""
         context = [
-            {"role": "user", "content": "Hello"}
+            {"role": "user", "content": "Hello"},
+            {"role": "assistant", "content": "Hi there!"}
         ]
-
-        response = await llm_service.process_message(
-            user_message="How are you?",
-            context=context
-        )
-
-        mock_llm_provider.generate.assert_called_once()
-        assert response == "This is a test response from the LLM"
-
-    async def test_process_message_includes_system_prompt(self, llm_service, mock_llm_provider):
-        """Test that process_message includes system prompt"""
-        context = []
-
-        await llm_service.process_message(
-            user_message="Test",
-            context=context
-        )
-
-        # Verify system prompt was added
-        call_args = mock_llm_provider.generate.call_args
-        messages = call_args.kwargs['messages']
-
-        assert messages[0]["role"] == "system"
-        assert "Лео" in messages[0]["content"]
-
-    async def test_process_message_includes_tools_in_system_prompt(self, llm_service, mock_llm_provider):
-        """Test that system prompt mentions tools when available"""
         tools = [
             {
                 "type": "function",
@@ -58,42 +38,37 @@ class TestLLMService:
             }
         ]
 
-        await llm_service.process_message(
-            user_message="Test",
-            context=[],
+        response = await llm_service.process_message(
+            user_message="How are you?",
+            context=context,
             tools=tools
         )
 
-        # Verify system prompt mentions tools
-        call_args = mock_llm_provider.generate.call_args
-        messages = call_args.kwargs['messages']
-
-        assert "инструмент" in messages[0]["content"].lower()
-
-    async def test_process_message_adds_context_messages(self, llm_service, mock_llm_provider):
-        """Test that process_message includes conversation context"""
-        context = [
-            {"role": "user", "content": "Hello"},
-            {"role": "assistant", "content": "Hi there!"}
-        ]
+        mock_llm_provider.generate.assert_called_once()
+        assert response == "This is a test response from the LLM"
 
-        await llm_service.process_message(
-            user_message="How are you?",
-            context=context
-        )
+        call_kwargs = mock_llm_provider.generate.call_args.kwargs
+        messages = call_kwargs['messages']
 
-        call_args = mock_llm_provider.generate.call_args
-        messages = call_args.kwargs['messages']
+        # System prompt first, and it mentions tools when they are available
+        assert messages[0]["role"] == "system"
+        assert "Лео" in messages[0]["content"]
+        assert "инструмент" in messages[0]["content"].lower()
 
-        # Should have: system + 2 context + user message
+        # Then the conversation context, then the current user message last
         assert len(messages) == 4
         assert messages[1] == context[0]
         assert messages[2] == context[1]
+        assert messages[-1] == {"role": "user", "content": "How are you?"}
+
+        assert call_kwargs['tools'] == tools
 
+    @pytest.mark.asyncio
     async def test_process_message_adds_mcp_context(self, llm_service, mock_llm_provider):
-        """Test that process_message injects MCP context"""
+        """Test that process_message injects formatted MCP context"""
         mcp_context = {
-            "test_mcp": {"data": "test data"}
+            "mcp1": {"key": "value"},
+            "mcp2": {"data": "test"}
         }
 
         await llm_service.process_message(
@@ -102,55 +77,19 @@ class TestLLMService:
             mcp_context=mcp_context
         )
 
-        call_args = mock_llm_provider.generate.call_args
-        messages = call_args.kwargs['messages']
-
-        # Find the MCP context message
-        mcp_message = None
-        for msg in messages:
-            if msg["role"] == "system" and "Additional context" in msg["content"]:
-                mcp_message = msg
-                break
-
-        assert mcp_message is not None
-        assert "test_mcp" in mcp_message["content"]
-
-    async def test_process_message_adds_user_message_last(self, llm_service, mock_llm_provider):
-        """Test that user message is added last"""
-        context = [
-            {"role": "user", "content": "Hello"}
-        ]
-
-        await llm_service.process_message(
-            user_message="How are you?",
-            context=context
+        messages = mock_llm_provider.generate.call_args.kwargs['messages']
+        mcp_message = next(
+            (msg for msg in messages if msg["role"] == "system" and "Additional context" in msg["content"]),
+            None
         )
 
-        call_args = mock_llm_provider.generate.call_args
-        messages = call_args.kwargs['messages']
-
-        # Last message should be the current user message
-        assert messages[-1]["role"] == "user"
-        assert messages[-1]["content"] == "How are you?"
-
-    async def test_process_message_passes_tools_to_provider(self, llm_service, mock_llm_provider):
-        """Test that tools are passed to provider"""
-        tools = [
-            {
-                "type": "function",
-                "function": {"name": "test_tool"}
-            }
-        ]
-
-        await llm_service.process_message(
-            user_message="Test",
-            context=[],
-            tools=tools
-        )
-
-        call_args = mock_llm_provider.generate.call_args
-        assert call_args.kwargs['tools'] == tools
+        assert mcp_message is not None
+        # _format_mcp_context output is injected verbatim
+        assert llm_service._format_mcp_context(mcp_context) in mcp_message["content"]
+        for expected in ("[mcp1]", "[mcp2]", '"key": "value"', '"data": "test"'):
+            assert expected in mcp_message["content"]
 
+    @pytest.mark.asyncio
     async def test_process_message_passes_stream_parameter(self, llm_service, mock_llm_provider):
         """Test that stream parameter is passed to provider"""
         await llm_service.process_message(
@@ -162,36 +101,16 @@ class TestLLMService:
         call_args = mock_llm_provider.generate.call_args
         assert call_args.kwargs['stream'] is True
 
-    async def test_format_mcp_context_formats_correctly(self, llm_service):
-        """Test that _format_mcp_context formats data correctly"""
-        mcp_context = {
-            "mcp1": {"key": "value"},
-            "mcp2": {"data": "test"}
-        }
-
-        formatted = llm_service._format_mcp_context(mcp_context)
-
-        assert "[mcp1]" in formatted
-        assert "[mcp2]" in formatted
-        assert '"key": "value"' in formatted
-        assert '"data": "test"' in formatted
-
-    async def test_health_check_calls_provider_health_check(self, llm_service, mock_llm_provider):
-        """Test that health_check calls provider's health_check"""
-        mock_llm_provider.health_check = AsyncMock(return_value=True)
+    @pytest.mark.parametrize("returned", [True, False], ids=["healthy", "unhealthy"])
+    @pytest.mark.asyncio
+    async def test_health_check_returns_provider_result(self, llm_service, mock_llm_provider, returned):
+        """Test that health_check delegates to the provider and returns its result"""
+        mock_llm_provider.health_check.return_value = returned
 
         result = await llm_service.health_check()
 
         mock_llm_provider.health_check.assert_called_once()
-        assert result is True
-
-    async def test_health_check_returns_false_on_failure(self, llm_service, mock_llm_provider):
-        """Test that health_check returns False when provider fails"""
-        mock_llm_provider.health_check = AsyncMock(return_value=False)
-
-        result = await llm_service.health_check()
-
-        assert result is False
+        assert result is returned
 
     def test_system_prompt_property_returns_prompt(self, llm_service):
         """Test that system_prompt property returns the prompt"""
@@ -210,6 +129,7 @@ class TestLLMService:
         assert llm_service.custom_system_prompt == new_prompt
         assert llm_service.system_prompt == new_prompt
 
+    @pytest.mark.asyncio
     async def test_process_message_uses_custom_system_prompt(self, llm_service, mock_llm_provider):
         """Test that custom system prompt is used when set"""
         custom_prompt = "Custom prompt text"
@@ -227,7 +147,7 @@ class TestLLMService:
         assert messages[0]["role"] == "system"
         assert custom_prompt in messages[0]["content"]
 
-    async def test_load_system_prompt_with_tools(self, llm_service):
+    def test_load_system_prompt_with_tools(self, llm_service):
         """Test that _load_system_prompt includes tool instructions when has_tools=True"""
         prompt_with_tools = llm_service._load_system_prompt(has_tools=True)
         prompt_without_tools = llm_service._load_system_prompt(has_tools=False)
@@ -235,6 +155,12 @@ class TestLLMService:
         assert "инструмент" in prompt_with_tools.lower()
         assert len(prompt_with_tools) > len(prompt_without_tools)
 
+    def test_load_system_prompt_is_cached(self, llm_service):
+        """Test that the system prompt is built once per has_tools value"""
+        assert llm_service._load_system_prompt(has_tools=True) is llm_service._load_system_prompt(has_tools=True)
+        assert llm_service._load_system_prompt(has_tools=False) is LLMService._load_system_prompt(has_tools=False)
+
+    @pytest.mark.asyncio
     async def test_process_message_with_empty_context(self, llm_service, mock_llm_provider):
         """Test that process_message works with empty context"""
         response = await llm_service.process_message(
@@ -245,6 +171,7 @@ class TestLLMService:
         assert response is not None
         mock_llm_provider.generate.assert_called_once()
 
+    @pytest.mark.asyncio
     async def test_process_message_passes_temperature_and_max_tokens(self, llm_service, mock_llm_provider, test_config):
         """Test that temperature and max_tokens from config are passed"""
         await llm_service.process_message(
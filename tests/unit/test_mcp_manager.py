@@ -1,5 +1,6 @@
 """Unit tests for MCPManager"""
 
+import asyncio
 import pytest
 from unittest.mock import AsyncMock
 
@@ -16,6 +17,7 @@ class TestMCPManager:
         """Create MCP manager"""
         return MCPManager()
 
+    @pytest.mark.asyncio
     async def test_register_mcp_adds_plugin(self, mcp_manager, mock_mcp_plugin):
         """Test that register_mcp adds a plugin to the manager"""
         await mcp_manager.register_mcp(mock_mcp_plugin)
@@ -24,13 +26,17 @@ class TestMCPManager:
         assert mcp_manager.mcps["test_mcp"] == mock_mcp_plugin
         mock_mcp_plugin.initialize.assert_called_once()
 
+    @pytest.mark.asyncio
     async def test_register_mcp_registers_tools(self, mcp_manager, mock_mcp_plugin):
         """Test that register_mcp registers all tools from the plugin"""
         await mcp_manager.register_mcp(mock_mcp_plugin)
 
         assert "test_tool" in mcp_manager.tool_registry
-        assert mcp_manager.tool_registry["test_tool"] == ("test_mcp", "test_tool")
+        mcp, schema = mcp_manager.tool_registry["test_tool"]
+        assert mcp is mock_mcp_plugin
+        assert schema["function"]["name"] == "test_tool"
 
+    @pytest.mark.asyncio
     async def test_register_mcp_handles_initialization_error(self, mcp_manager, mock_mcp_plugin):
         """Test that register_mcp handles initialization errors"""
         mock_mcp_plugin.initialize = AsyncMock(side_effect=Exception("Init failed"))
@@ -41,6 +47,7 @@ class TestMCPManager:
         # MCP should not be registered
         assert "test_mcp" not in mcp_manager.mcps
 
+    @pytest.mark.asyncio
     async def test_execute_tool_calls_correct_mcp(self, mcp_manager, mock_mcp_plugin):
         """Test that execute_tool calls the correct MCP plugin"""
         await mcp_manager.register_mcp(mock_mcp_plugin)
@@ -56,6 +63,39 @@ class TestMCPManager:
         )
         assert "result" in result
 
+    @pytest.mark.asyncio
+    async def test_execute_tool_memoizes_on_repeat(self, mcp_manager, mock_mcp_plugin):
+        """Test that memoizable tools reuse the result of an identical call"""
+        mock_mcp_plugin.can_memoize.return_value = True
+        await mcp_manager.register_mcp(mock_mcp_plugin)
+
+        first = await mcp_manager.execute_tool("test_tool", {"query": "test", "limit": 5})
+        # Same parameters in a different order hit the memo
+        second = await mcp_manager.execute_tool("test_tool", {"limit": 5, "query": "test"})
+        await mcp_manager.execute_tool("test_tool", {"query": "other"})
+
+        assert second == first
+        assert mock_mcp_plugin.execute_tool.await_count == 2
+
+        mcp_manager.clear_memo_cache()
+        await mcp_manager.execute_tool("test_tool", {"query": "test", "limit": 5})
+
+        assert mock_mcp_plugin.execute_tool.await_count == 3
+
+    @pytest.mark.asyncio
+    async def test_execute_tool_does_not_memoize_failures(self, mcp_manager, mock_mcp_plugin):
+        """Test that unsuccessful results are not reused"""
+        mock_mcp_plugin.can_memoize.return_value = True
+        mock_mcp_plugin.execute_tool.side_effect = None
+        mock_mcp_plugin.execute_tool.return_value = {"success": False, "error": "timeout"}
+        await mcp_manager.register_mcp(mock_mcp_plugin)
+
+        await mcp_manager.execute_tool("test_tool", {"query": "test"})
+        await mcp_manager.execute_tool("test_tool", {"query": "test"})
+
+        assert mock_mcp_plugin.execute_tool.await_count == 2
+
+    @pytest.mark.asyncio
     async def test_execute_tool_raises_error_for_unknown_tool(self, mcp_manager):
         """Test that execute_tool raises error for unknown tool"""
         with pytest.raises(ValueError, match="Tool not found: unknown_tool"):
@@ -64,6 +104,7 @@ class TestMCPManager:
                 parameters={}
             )
 
+    @pytest.mark.asyncio
     async def test_get_all_tools_returns_all_enabled_tools(self, mcp_manager, mock_mcp_plugin):
         """Test that get_all_tools returns tools from all enabled MCPs"""
         await mcp_manager.register_mcp(mock_mcp_plugin)
@@ -73,6 +114,32 @@ class TestMCPManager:
         assert len(tools) == 1
         assert tools[0]["function"]["name"] == "test_tool"
 
+    @pytest.mark.asyncio
+    async def test_get_all_tools_reuses_tools_fetched_at_registration(self, mcp_manager, mock_mcp_plugin):
+        """Test that get_all_tools does not query plugins again after registration"""
+        await mcp_manager.register_mcp(mock_mcp_plugin)
+
+        first = await mcp_manager.get_all_tools()
+        second = await mcp_manager.get_all_tools()
+
+        assert first == second
+        assert mock_mcp_plugin.get_tools.call_count == 1
+
+    @pytest.mark.asyncio
+    async def test_disable_and_enable_toggle_mcp_tools(self, mcp_manager, mock_mcp_plugin):
+        """Test that disable()/enable() control whether an MCP's tools are offered"""
+        await mcp_manager.register_mcp(mock_mcp_plugin)
+
+        mcp_manager.disable("test_mcp")
+        assert await mcp_manager.get_all_tools() == []
+
+        mcp_manager.enable("test_mcp")
+        assert len(await mcp_manager.get_all_tools()) == 1
+
+        with pytest.raises(ValueError, match="MCP not found: missing"):
+            mcp_manager.disable("missing")
+
+    @pytest.mark.asyncio
     async def test_get_all_tools_excludes_disabled_mcps(self, mcp_manager, mock_mcp_plugin):
         """Test that get_all_tools excludes disabled MCPs"""
         await mcp_manager.register_mcp(mock_mcp_plugin)
@@ -84,6 +151,7 @@ class TestMCPManager:
 
         assert len(tools) == 0
 
+    @pytest.mark.asyncio
     async def test_get_all_tools_with_multiple_mcps(self, mcp_manager, mock_mcp_plugin):
         """Test get_all_tools with multiple MCP plugins"""
         # Register first MCP
@@ -117,6 +185,7 @@ class TestMCPManager:
         assert "test_tool" in tool_names
         assert "tool2" in tool_names
 
+    @pytest.mark.asyncio
     async def test_gather_context_calls_all_mcps(self, mcp_manager, mock_mcp_plugin):
         """Test that gather_context calls get_context on all MCPs"""
         await mcp_manager.register_mcp(mock_mcp_plugin)
@@ -126,6 +195,7 @@ class TestMCPManager:
         assert "test_mcp" in context
         mock_mcp_plugin.get_context.assert_called_once_with("test query")
 
+    @pytest.mark.asyncio
     async def test_gather_context_with_specific_mcps(self, mcp_manager, mock_mcp_plugin):
         """Test that gather_context can query specific MCPs only"""
         await mcp_manager.register_mcp(mock_mcp_plugin)
@@ -151,6 +221,7 @@ class TestMCPManager:
         mock_mcp_plugin.get_context.assert_called_once()
         mcp2.get_context.assert_not_called()
 
+    @pytest.mark.asyncio
     async def test_gather_context_handles_mcp_errors(self, mcp_manager, mock_mcp_plugin):
         """Test that gather_context handles errors from individual MCPs"""
         mock_mcp_plugin.get_context = AsyncMock(side_effect=Exception("Context error"))
@@ -163,6 +234,30 @@ class TestMCPManager:
         # Context should be empty since the only MCP failed
         assert context == {}
 
+    @pytest.mark.asyncio
+    async def test_gather_context_queries_mcps_concurrently(self, mcp_manager):
+        """Test that gather_context has every MCP in flight at the same time"""
+        # Each call only returns once both are waiting, so a sequential
+        # gather never gets past the first MCP
+        both_in_flight = asyncio.Barrier(2)
+
+        async def waiting_get_context(query):
+            await both_in_flight.wait()
+            return {"query": query}
+
+        for name in ("slow1", "slow2"):
+            mcp = AsyncMock(spec=BaseMCP)
+            mcp.name = name
+            mcp.enabled = True
+            mcp.get_tools = AsyncMock(return_value=[])
+            mcp.get_context = AsyncMock(side_effect=waiting_get_context)
+            await mcp_manager.register_mcp(mcp)
+
+        context = await asyncio.wait_for(mcp_manager.gather_context("test query"), timeout=5)
+
+        assert set(context) == {"slow1", "slow2"}
+
+    @pytest.mark.asyncio
     async def test_gather_context_skips_disabled_mcps(self, mcp_manager, mock_mcp_plugin):
         """Test that gather_context skips disabled MCPs"""
         await mcp_manager.register_mcp(mock_mcp_plugin)
@@ -175,6 +270,7 @@ class TestMCPManager:
         assert context == {}
         mock_mcp_plugin.get_context.assert_not_called()
 
+    @pytest.mark.asyncio
     async def test_shutdown_all_calls_shutdown_on_all_mcps(self, mcp_manager, mock_mcp_plugin):
         """Test that shutdown_all calls shutdown on all MCPs"""
         await mcp_manager.register_mcp(mock_mcp_plugin)
@@ -183,6 +279,7 @@ class TestMCPManager:
 
         mock_mcp_plugin.shutdown.assert_called_once()
 
+    @pytest.mark.asyncio
     async def test_shutdown_all_handles_errors(self, mcp_manager, mock_mcp_plugin):
         """Test that shutdown_all handles errors from individual MCPs"""
         mock_mcp_plugin.shutdown = AsyncMock(side_effect=Exception("Shutdown error"))
@@ -224,6 +321,7 @@ class TestMCPManager:
 
         assert mcps_list == []
 
+    @pytest.mark.asyncio
     async def test_register_multiple_mcps_with_different_tools(self, mcp_manager, mock_mcp_plugin):
         """Test registering multiple MCPs with different tools"""
         # Register first MCP
@@ -256,9 +354,10 @@ class TestMCPManager:
         assert "different_tool" in mcp_manager.tool_registry
 
         # Verify they map to different MCPs
-        assert mcp_manager.tool_registry["test_tool"][0] == "test_mcp"
-        assert mcp_manager.tool_registry["different_tool"][0] == "mcp2"
+        assert mcp_manager.tool_registry["test_tool"][0] is mock_mcp_plugin
+        assert mcp_manager.tool_registry["different_tool"][0] is mcp2
 
+    @pytest.mark.asyncio
     async def test_execute_tool_with_complex_parameters(self, mcp_manager, mock_mcp_plugin):
         """Test execute_tool with complex nested parameters"""
         await mcp_manager.register_mcp(mock_mcp_plugin)
@@ -1,156 +1,216 @@
 """Unit tests for RateLimiter"""
 
 import pytest
-from unittest.mock import AsyncMock, patch
-from bot.rate_limiter import RateLimiter
+import pytest_asyncio
+from unittest.mock import patch
+from bot.rate_limiter import RateLimiter, _user_key
+from bot.redis_pool import get_pool
 
 
 @pytest.mark.unit
 class TestRateLimiter:
     """Test RateLimiter functionality"""
 
-    @pytest.fixture
+    @pytest_asyncio.fixture
     async def rate_limiter(self, mock_redis):
         """Create rate limiter with mocked Redis"""
-        with patch('bot.rate_limiter.aioredis.from_url', return_value=mock_redis):
-            limiter = RateLimiter()
-            limiter._redis = mock_redis
-            yield limiter
-            await limiter.close()
+        limiter = RateLimiter(redis=mock_redis)
+        yield limiter
+        await limiter.close()
 
+    @pytest.mark.asyncio
     async def test_check_limit_allows_first_request(self, rate_limiter, mock_redis):
         """Test that first request is always allowed"""
-        # Mock Redis to return None (no existing counter)
-        mock_redis.get = AsyncMock(return_value=None)
-
         allowed, retry_after = await rate_limiter.check_limit(user_id=12345)
 
         assert allowed is True
         assert retry_after is None
 
+    @pytest.mark.asyncio
     async def test_check_limit_blocks_after_exceeding_user_limit(self, rate_limiter, mock_redis):
         """Test that requests are blocked after exceeding user limit"""
-        # Mock Redis to return max requests
-        async def mock_get(key):
-            if "user" in key:
-                return str(rate_limiter.user_requests)  # At limit
-            return "0"
-
-        mock_redis.get = AsyncMock(side_effect=mock_get)
-        mock_redis.ttl = AsyncMock(return_value=30)
+        # User counter at the limit
+        await mock_redis.set("ratelimit:user:12345", rate_limiter.user_requests, ex=30)
 
         allowed, retry_after = await rate_limiter.check_limit(user_id=12345)
 
         assert allowed is False
         assert retry_after == 30
 
+    @pytest.mark.asyncio
     async def test_check_limit_blocks_after_exceeding_global_limit(self, rate_limiter, mock_redis):
         """Test that requests are blocked after exceeding global limit"""
-        # Mock Redis to return below user limit but at global limit
-        async def mock_get(key):
-            if "user" in key:
-                return "5"  # Below user limit
-            if "global" in key:
-                return str(rate_limiter.global_requests)  # At global limit
-            return "0"
-
-        mock_redis.get = AsyncMock(side_effect=mock_get)
-        mock_redis.ttl = AsyncMock(return_value=45)
+        # User counter below its limit, global counter at the limit
+        await mock_redis.set("ratelimit:user:12345", 5, ex=30)
+        await mock_redis.set("ratelimit:global", rate_limiter.global_requests, ex=45)
 
         allowed, retry_after = await rate_limiter.check_limit(user_id=12345)
 
         assert allowed is False
         assert retry_after == 45
 
+    @pytest.mark.asyncio
+    async def test_check_limit_reads_counters_in_one_pipeline(self, rate_limiter, mock_redis):
+        """Test that both counters and TTLs are fetched in a single round-trip"""
+        with patch.object(mock_redis, "pipeline", wraps=mock_redis.pipeline) as pipeline, \
+             patch.object(mock_redis, "get", wraps=mock_redis.get) as get:
+            await rate_limiter.check_limit(user_id=12345)
+
+        pipeline.assert_called_once()
+        get.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_check_limit_uses_local_cache_on_repeated_block(self, rate_limiter, mock_redis):
+        """Test that a blocked user is answered locally until retry_after elapses"""
+        await mock_redis.set("ratelimit:user:12345", rate_limiter.user_requests, ex=30)
+        await rate_limiter.check_limit(user_id=12345)
+
+        with patch.object(mock_redis, "pipeline", wraps=mock_redis.pipeline) as pipeline:
+            allowed, retry_after = await rate_limiter.check_limit(user_id=12345)
+
+        assert allowed is False
+        assert 0 < retry_after <= 30
+        pipeline.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_reset_user_limit_clears_local_block(self, rate_limiter, mock_redis):
+        """Test that resetting a user also drops the locally cached block"""
+        await mock_redis.set("ratelimit:user:12345", rate_limiter.user_requests, ex=30)
+        await rate_limiter.check_and_consume(user_id=12345)
+
+        await rate_limiter.reset_user_limit(user_id=12345)
+        allowed, retry_after = await rate_limiter.check_and_consume(user_id=12345)
+
+        assert allowed is True
+        assert retry_after is None
+
+    def test_local_blocks_are_bounded(self, rate_limiter, monkeypatch):
+        """Test that the local block cache forgets the oldest blocked user"""
+        monkeypatch.setattr(RateLimiter, "LOCAL_BLOCK_CACHE_SIZE", 2)
+
+        rate_limiter._block_locally(1, 30)
+        rate_limiter._block_locally(2, 30)
+        rate_limiter._block_locally(1, 30)
+        rate_limiter._block_locally(3, 30)
+
+        assert list(rate_limiter._local_block) == [1, 3]
+
+    @pytest.mark.asyncio
+    async def test_check_and_consume_allows_and_consumes(self, rate_limiter, mock_redis):
+        """Test that an allowed request is checked and consumed by one script call"""
+        allowed, retry_after = await rate_limiter.check_and_consume(user_id=12345)
+
+        assert allowed is True
+        assert retry_after is None
+        assert await mock_redis.get("ratelimit:user:12345") == b"1"
+        assert await mock_redis.get("ratelimit:global") == b"1"
+        assert await mock_redis.ttl("ratelimit:user:12345") == rate_limiter.user_window
+
+    @pytest.mark.asyncio
+    async def test_check_and_consume_blocks_with_retry_after(self, rate_limiter, mock_redis):
+        """Test that a limited request returns the TTL reported by the script"""
+        await mock_redis.set("ratelimit:user:12345", rate_limiter.user_requests, ex=42)
+
+        allowed, retry_after = await rate_limiter.check_and_consume(user_id=12345)
+
+        assert allowed is False
+        assert retry_after == 42
+        # A rejected request does not consume a token
+        assert await mock_redis.get("ratelimit:global") is None
+
+    @pytest.mark.asyncio
+    async def test_check_and_consume_registers_script_once(self, rate_limiter, mock_redis):
+        """Test that the Lua script is registered only on first use"""
+        with patch.object(mock_redis, "register_script", wraps=mock_redis.register_script) as register:
+            await rate_limiter.check_and_consume(user_id=12345)
+            await rate_limiter.check_and_consume(user_id=12345)
+
+        register.assert_called_once()
+
+    @pytest.mark.asyncio
     async def test_consume_token_increments_counters(self, rate_limiter, mock_redis):
         """Test that consuming a token increments both user and global counters"""
         await rate_limiter.consume_token(user_id=12345)
 
-        # Verify pipeline was called
-        mock_redis.pipeline.assert_called_once()
+        assert await mock_redis.get("ratelimit:user:12345") == b"1"
+        assert await mock_redis.get("ratelimit:global") == b"1"
 
+    @pytest.mark.asyncio
     async def test_consume_token_sets_expiration(self, rate_limiter, mock_redis):
         """Test that consuming a token sets expiration on counters"""
-        pipe_mock = mock_redis.pipeline()
-
         await rate_limiter.consume_token(user_id=12345)
 
-        # Verify expire was called in pipeline
-        assert pipe_mock.expire.call_count == 2
+        assert await mock_redis.ttl("ratelimit:user:12345") == rate_limiter.user_window
+        assert await mock_redis.ttl("ratelimit:global") == rate_limiter.global_window
 
+    @pytest.mark.asyncio
     async def test_reset_user_limit_clears_counter(self, rate_limiter, mock_redis):
         """Test that resetting user limit clears their counter"""
+        await mock_redis.set("ratelimit:user:12345", 5)
+
         await rate_limiter.reset_user_limit(user_id=12345)
 
-        mock_redis.delete.assert_called_once_with("ratelimit:user:12345")
+        assert await mock_redis.exists("ratelimit:user:12345") == 0
+
+    def test_user_key_is_cached_bytes(self):
+        """Test that user keys are built once per user as bytes"""
+        key = _user_key(12345)
 
+        assert key == b"ratelimit:user:12345"
+        assert _user_key(12345) is key
+
+    @pytest.mark.asyncio
     async def test_check_limit_with_zero_ttl_uses_window(self, rate_limiter, mock_redis):
         """Test that when TTL is 0 or negative, we use the configured window"""
-        async def mock_get(key):
-            if "user" in key:
-                return str(rate_limiter.user_requests)
-            return "0"
-
-        mock_redis.get = AsyncMock(side_effect=mock_get)
-        mock_redis.ttl = AsyncMock(return_value=-1)  # No TTL set
+        # Counter at the limit with no TTL set
+        await mock_redis.set("ratelimit:user:12345", rate_limiter.user_requests)
 
         allowed, retry_after = await rate_limiter.check_limit(user_id=12345)
 
         assert allowed is False
         assert retry_after == rate_limiter.user_window
 
+    @pytest.mark.asyncio
     async def test_multiple_users_independent_limits(self, rate_limiter, mock_redis):
         """Test that different users have independent rate limits"""
-        # User 1 at limit
-        async def mock_get_user1(key):
-            if "user:12345" in key:
-                return str(rate_limiter.user_requests)
-            return "0"
-
-        # User 2 not at limit
-        async def mock_get_user2(key):
-            if "user:67890" in key:
-                return "0"
-            return "0"
-
-        # Check user 1 (should be blocked)
-        mock_redis.get = AsyncMock(side_effect=mock_get_user1)
-        mock_redis.ttl = AsyncMock(return_value=30)
-        allowed_1, _ = await rate_limiter.check_limit(user_id=12345)
+        # User 1 at limit, user 2 has no requests yet
+        await mock_redis.set("ratelimit:user:12345", rate_limiter.user_requests, ex=30)
 
-        # Check user 2 (should be allowed)
-        mock_redis.get = AsyncMock(side_effect=mock_get_user2)
+        allowed_1, _ = await rate_limiter.check_limit(user_id=12345)
         allowed_2, _ = await rate_limiter.check_limit(user_id=67890)
 
         assert allowed_1 is False
         assert allowed_2 is True
 
+    @pytest.mark.asyncio
     async def test_close_closes_redis_connection(self, rate_limiter, mock_redis):
         """Test that close() properly closes Redis connection"""
-        await rate_limiter.close()
+        with patch.object(mock_redis, "close", wraps=mock_redis.close) as close:
+            await rate_limiter.close()
 
-        mock_redis.close.assert_called_once()
+        close.assert_called_once()
 
-    async def test_get_redis_creates_connection_once(self, mock_redis):
-        """Test that Redis connection is created only once"""
-        with patch('bot.rate_limiter.aioredis.from_url', return_value=mock_redis) as mock_from_url:
+    @pytest.mark.asyncio
+    async def test_get_redis_creates_connection_once(self):
+        """Test that the Redis client is created only once, on the shared pool"""
+        with patch('bot.rate_limiter.get_pool', wraps=get_pool) as mock_get_pool:
             limiter = RateLimiter()
 
             # Call multiple times
-            await limiter._get_redis()
+            first = await limiter._get_redis()
             await limiter._get_redis()
             await limiter._get_redis()
 
-            # Should only create connection once
-            mock_from_url.assert_called_once()
+            # Should only create the client once
+            mock_get_pool.assert_called_once_with(limiter.redis_url)
+            assert first.connection_pool is get_pool(limiter.redis_url)
 
             await limiter.close()
 
+    @pytest.mark.asyncio
     async def test_check_limit_handles_redis_errors_gracefully(self, rate_limiter, mock_redis):
         """Test that Redis errors don't crash the rate limiter"""
-        # Mock Redis to raise an exception
-        mock_redis.get = AsyncMock(side_effect=Exception("Redis connection failed"))
-
         # Should raise the exception (in production, this would be caught by handler)
-        with pytest.raises(Exception, match="Redis connection failed"):
-            await rate_limiter.check_limit(user_id=12345)
+        with patch.object(mock_redis, "pipeline", side_effect=Exception("Redis connection failed")):
+            with pytest.raises(Exception, match="Redis connection failed"):
+                await rate_limiter.check_limit(user_id=12345)
@@ -0,0 +1,32 @@
+"""Unit tests for the shared Redis connection pool"""
+
+import pytest
+
+from bot import redis_pool
+
+
+@pytest.mark.unit
+class TestRedisPool:
+    """Test shared pool creation and shutdown"""
+
+    @pytest.mark.asyncio
+    async def test_get_pool_returns_one_pool_per_url(self):
+        """Test that callers share a pool per Redis URL"""
+        try:
+            pool = redis_pool.get_pool("redis://localhost:6379/15")
+
+            assert redis_pool.get_pool("redis://localhost:6379/15") is pool
+            assert redis_pool.get_pool("redis://localhost:6379/14") is not pool
+            assert pool.max_connections == redis_pool.MAX_CONNECTIONS
+        finally:
+            await redis_pool.close_pools()
+
+    @pytest.mark.asyncio
+    async def test_close_pools_forgets_pools(self):
+        """Test that a pool requested after shutdown is a fresh one"""
+        pool = redis_pool.get_pool("redis://localhost:6379/15")
+
+        await redis_pool.close_pools()
+
+        assert redis_pool.get_pool("redis://localhost:6379/15") is not pool
+        await redis_pool.close_pools()
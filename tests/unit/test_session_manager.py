@@ -1,10 +1,12 @@
 """Unit tests for SessionManager"""
 
 import pytest
-import json
+import pytest_asyncio
+import orjson
 from datetime import datetime
-from unittest.mock import AsyncMock, patch
-from sqlalchemy import select
+from unittest.mock import patch
+from sqlalchemy import event, select
+from sqlalchemy.orm import undefer
 
 from bot.session import SessionManager, UserSession, Message
 from bot.models import User, Session as SessionModel, Message as MessageModel
@@ -14,21 +16,18 @@ from bot.models import User, Session as SessionModel, Message as MessageModel
 class TestSessionManager:
     """Test SessionManager functionality"""
 
-    @pytest.fixture
+    @pytest_asyncio.fixture
     async def session_manager(self, test_db_session, mock_redis):
         """Create session manager with test database and mocked Redis"""
-        with patch('bot.session.aioredis.from_url', return_value=mock_redis):
-            manager = SessionManager(test_db_session)
-            manager._redis = mock_redis
-            yield manager
-            await manager.close()
+        SessionManager._user_cache.clear()
+        SessionManager._touched.clear()
+        manager = SessionManager(test_db_session, redis=mock_redis)
+        yield manager
+        await manager.close()
 
+    @pytest.mark.asyncio
     async def test_get_session_creates_new_user(self, session_manager, telegram_user, mock_redis):
         """Test that get_session creates a new user if doesn't exist"""
-        # Mock Redis to return no cache
-        mock_redis.get = AsyncMock(return_value=None)
-        mock_redis.setex = AsyncMock(return_value=True)
-
         user_session = await session_manager.get_session(
             user_id=12345,
             telegram_id=12345,
@@ -39,11 +38,9 @@ class TestSessionManager:
         assert user_session.user_id > 0
         assert user_session.session_id > 0
 
+    @pytest.mark.asyncio
     async def test_get_session_uses_existing_user(self, session_manager, test_user, telegram_user, mock_redis):
         """Test that get_session uses existing user"""
-        mock_redis.get = AsyncMock(return_value=None)
-        mock_redis.setex = AsyncMock(return_value=True)
-
         user_session = await session_manager.get_session(
             user_id=test_user.telegram_id,
             telegram_id=test_user.telegram_id,
@@ -52,31 +49,37 @@ class TestSessionManager:
 
         assert user_session.user_id == test_user.id
 
+    @pytest.mark.asyncio
     async def test_get_session_returns_cached_session(self, session_manager, test_user, test_session, mock_redis):
         """Test that get_session returns cached session if available"""
         # Mock cached session data
         cached_data = {
             "user_id": test_user.id,
             "session_id": test_session.id,
-            "created_at": test_session.created_at.isoformat(),
-            "last_active": test_session.last_active.isoformat(),
+            "created_at": test_session.created_at,
+            "last_active": test_session.last_active,
             "active_mcps": [],
             "preferences": {},
             "metadata": {}
         }
-        mock_redis.get = AsyncMock(return_value=json.dumps(cached_data))
+        await mock_redis.set(f"session:{test_user.telegram_id}", orjson.dumps(cached_data))
 
-        user_session = await session_manager.get_session(
-            user_id=test_user.telegram_id,
-            telegram_id=test_user.telegram_id
-        )
+        with patch.object(session_manager, "_get_or_create_user") as get_or_create_user:
+            user_session = await session_manager.get_session(
+                user_id=test_user.telegram_id,
+                telegram_id=test_user.telegram_id
+            )
 
         assert user_session.session_id == test_session.id
-        mock_redis.get.assert_called_once_with(f"session:{test_user.telegram_id}")
+        assert user_session.created_at == test_session.created_at
+        # Served from the cache without touching the database
+        get_or_create_user.assert_not_called()
 
+    @pytest.mark.asyncio
     async def test_update_context_adds_message(self, session_manager, test_session):
         """Test that update_context adds a message to the session"""
         await session_manager.update_context(
+            user_id=12345,
             session_id=test_session.id,
             role="user",
             content="Test message",
@@ -85,7 +88,11 @@ class TestSessionManager:
         )
 
         # Verify message was added to database
-        stmt = select(MessageModel).where(MessageModel.session_id == test_session.id)
+        stmt = (
+            select(MessageModel)
+            .where(MessageModel.session_id == test_session.id)
+            .options(undefer(MessageModel.message_metadata))
+        )
         result = await session_manager.db.execute(stmt)
         messages = result.scalars().all()
 
@@ -95,6 +102,7 @@ class TestSessionManager:
         assert messages[0].tokens == 10
         assert messages[0].message_metadata == {"test": "data"}
 
+    @pytest.mark.asyncio
     async def test_get_context_window_returns_recent_messages(self, session_manager, test_session, test_messages):
         """Test that get_context_window returns recent messages"""
         context = await session_manager.get_context_window(test_session.id)
@@ -105,18 +113,20 @@ class TestSessionManager:
         assert context[1]["role"] == "assistant"
         assert context[1]["content"] == "Hi there!"
 
+    @pytest.mark.asyncio
     async def test_get_context_window_respects_token_limit(self, session_manager, test_session, test_db_session):
         """Test that get_context_window respects max token limit"""
         # Add many messages
-        for i in range(20):
-            msg = MessageModel(
+        test_db_session.add_all([
+            MessageModel(
                 session_id=test_session.id,
                 role="user" if i % 2 == 0 else "assistant",
                 content=f"Message {i}",
                 tokens=100,
                 message_metadata={}
             )
-            test_db_session.add(msg)
+            for i in range(20)
+        ])
         await test_db_session.commit()
 
         # Get context with small token limit
@@ -127,7 +137,10 @@ class TestSessionManager:
 
         # Should return fewer messages due to token limit
         assert len(context) <= 5
+        # The newest messages that fit, in chronological order
+        assert [m["content"] for m in context] == [f"Message {i}" for i in range(15, 20)]
 
+    @pytest.mark.asyncio
     async def test_clear_session_deletes_messages(self, session_manager, test_session, test_messages):
         """Test that clear_session deletes all messages"""
         # Verify messages exist
@@ -145,24 +158,29 @@ class TestSessionManager:
         messages_after = result.scalars().all()
         assert len(messages_after) == 0
 
+    @pytest.mark.asyncio
     async def test_load_messages_returns_limited_count(self, session_manager, test_session, test_db_session):
         """Test that _load_messages returns limited number of messages"""
         # Add 20 messages
-        for i in range(20):
-            msg = MessageModel(
+        test_db_session.add_all([
+            MessageModel(
                 session_id=test_session.id,
                 role="user",
                 content=f"Message {i}",
                 message_metadata={}
             )
-            test_db_session.add(msg)
+            for i in range(20)
+        ])
         await test_db_session.commit()
 
         # Load with default limit (10)
         messages = await session_manager._load_messages(test_session.id, limit=10)
 
         assert len(messages) == 10
+        # The ten newest, oldest first
+        assert [m.content for m in messages] == [f"Message {i}" for i in range(10, 20)]
 
+    @pytest.mark.asyncio
     async def test_load_messages_returns_chronological_order(self, session_manager, test_session, test_messages):
         """Test that _load_messages returns messages in chronological order"""
         messages = await session_manager._load_messages(test_session.id)
@@ -175,6 +193,7 @@ class TestSessionManager:
         assert messages[-1].role == "assistant"
         assert messages[-1].content == "Hi there!"
 
+    @pytest.mark.asyncio
     async def test_get_or_create_user_creates_admin_user(self, session_manager, telegram_admin_user, test_config):
         """Test that _get_or_create_user marks admin users correctly"""
         user = await session_manager._get_or_create_user(
@@ -185,6 +204,7 @@ class TestSessionManager:
         assert user.is_admin is True
         assert user.telegram_id == 99999
 
+    @pytest.mark.asyncio
     async def test_get_or_create_user_updates_changed_info(self, session_manager, test_user, telegram_user):
         """Test that _get_or_create_user updates user info if changed"""
         # Change username
@@ -201,7 +221,50 @@ class TestSessionManager:
         assert user.username == "new_username"
         assert user.first_name == "New"
 
-    async def test_serialize_session_converts_to_dict(self, session_manager, test_user, test_session):
+    @pytest.mark.asyncio
+    async def test_get_or_create_user_caches_unchanged_user(self, session_manager, test_user, telegram_user):
+        """Test that a repeat lookup with an unchanged profile skips the upsert"""
+        with patch.object(session_manager.db, "execute", wraps=session_manager.db.execute) as mock_execute:
+            first = await session_manager._get_or_create_user(
+                telegram_id=test_user.telegram_id,
+                telegram_user=telegram_user
+            )
+            second = await session_manager._get_or_create_user(
+                telegram_id=test_user.telegram_id,
+                telegram_user=telegram_user
+            )
+
+            assert mock_execute.await_count == 1
+            assert second.id == first.id
+
+            # A profile change goes back to the database
+            telegram_user.username = "renamed"
+            await session_manager._get_or_create_user(
+                telegram_id=test_user.telegram_id,
+                telegram_user=telegram_user
+            )
+
+        assert mock_execute.await_count == 2
+
+    @pytest.mark.asyncio
+    async def test_get_or_create_user_cache_is_shared_across_instances(self, session_manager, test_user, telegram_user, mock_redis):
+        """Test that a per-request SessionManager reuses users seen by another instance"""
+        await session_manager._get_or_create_user(
+            telegram_id=test_user.telegram_id,
+            telegram_user=telegram_user
+        )
+
+        other = SessionManager(session_manager.db, redis=mock_redis)
+        with patch.object(other.db, "execute", wraps=other.db.execute) as mock_execute:
+            user = await other._get_or_create_user(
+                telegram_id=test_user.telegram_id,
+                telegram_user=telegram_user
+            )
+
+        mock_execute.assert_not_called()
+        assert user.telegram_id == test_user.telegram_id
+
+    def test_serialize_session_converts_to_dict(self, session_manager, test_user, test_session):
         """Test that _serialize_session converts UserSession to dict"""
         user_session = UserSession(
             user_id=test_user.id,
@@ -220,21 +283,25 @@ class TestSessionManager:
         assert serialized["active_mcps"] == ["test_mcp"]
         assert serialized["preferences"] == {"lang": "en"}
         assert serialized["metadata"] == {"key": "value"}
-        assert isinstance(serialized["created_at"], str)
-        assert isinstance(serialized["last_active"], str)
+        assert serialized["created_at"] == test_session.created_at
+        assert serialized["last_active"] == test_session.last_active
 
+    @pytest.mark.asyncio
     async def test_close_closes_redis_connection(self, session_manager, mock_redis):
         """Test that close() closes Redis connection"""
-        await session_manager.close()
+        with patch.object(mock_redis, "close", wraps=mock_redis.close) as close:
+            await session_manager.close()
 
-        mock_redis.close.assert_called_once()
+        close.assert_called_once()
 
+    @pytest.mark.asyncio
     async def test_update_context_updates_session_last_active(self, session_manager, test_session, test_db_session):
         """Test that update_context updates session last_active timestamp"""
         original_last_active = test_session.last_active
 
         # Wait a moment and add a message
         await session_manager.update_context(
+            user_id=12345,
             session_id=test_session.id,
             role="user",
             content="New message"
@@ -247,17 +314,109 @@ class TestSessionManager:
         # last_active should be updated
         assert test_session.last_active >= original_last_active
 
+    @pytest.mark.asyncio
+    async def test_update_context_throttles_last_active_updates(self, session_manager, test_session):
+        """Test that last_active is written at most once per interval per session"""
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        engine = session_manager.db.get_bind()
+        event.listen(engine, "before_cursor_execute", record)
+        try:
+            for content in ("First", "Second"):
+                await session_manager.update_context(
+                    user_id=12345,
+                    session_id=test_session.id,
+                    role="user",
+                    content=content
+                )
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+
+        assert sum(s.startswith("UPDATE sessions") for s in statements) == 1
+
+    @pytest.mark.asyncio
+    async def test_clear_session_counts_as_touch_for_other_instances(self, session_manager, test_session, mock_redis):
+        """Test that a reset on one SessionManager throttles last_active for another"""
+        other = SessionManager(session_manager.db, redis=mock_redis)
+        await other.clear_session(test_session.id)
+
+        with patch.object(session_manager.db, "execute", wraps=session_manager.db.execute) as mock_execute:
+            await session_manager.update_context(
+                user_id=12345,
+                session_id=test_session.id,
+                role="user",
+                content="After reset"
+            )
+
+        # Only the message INSERT, no last_active UPDATE
+        assert mock_execute.await_count == 1
+
+    def test_touched_sessions_are_bounded(self, session_manager, monkeypatch):
+        """Test that the last_active throttle forgets the least recently touched session"""
+        monkeypatch.setattr(SessionManager, "TOUCHED_CACHE_SIZE", 2)
+
+        session_manager._mark_touched(1, 1.0)
+        session_manager._mark_touched(2, 2.0)
+        session_manager._mark_touched(1, 3.0)
+        session_manager._mark_touched(3, 4.0)
+
+        assert list(session_manager._touched) == [1, 3]
+
+    @pytest.mark.asyncio
+    async def test_update_context_batch_adds_messages_in_order(self, session_manager, test_session):
+        """Test that update_context_batch stores every message with one INSERT and one flush"""
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        engine = session_manager.db.get_bind()
+        event.listen(engine, "before_cursor_execute", record)
+        try:
+            with patch.object(session_manager.db, "flush", wraps=session_manager.db.flush) as mock_flush:
+                await session_manager.update_context_batch(
+                    user_id=12345,
+                    session_id=test_session.id,
+                    messages=[
+                        {"role": "assistant", "content": ""},
+                        {"role": "tool", "content": "result", "metadata": {"tool_name": "web_search"}},
+                    ],
+                )
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+
+        mock_flush.assert_awaited_once()
+        assert sum(s.startswith("INSERT INTO messages") for s in statements) == 1
+        messages = await session_manager._load_messages(test_session.id)
+        assert [(m.role, m.content) for m in messages] == [("assistant", ""), ("tool", "result")]
+
+    @pytest.mark.asyncio
+    async def test_update_context_refreshes_session_cache_ttl(self, session_manager, test_session, mock_redis):
+        """Test that update_context keeps the cached session alive"""
+        await mock_redis.set("session:12345", b"{}", ex=60)
+
+        await session_manager.update_context(
+            user_id=12345,
+            session_id=test_session.id,
+            role="user",
+            content="Hello"
+        )
+
+        assert await mock_redis.ttl("session:12345") == SessionManager.SESSION_CACHE_TTL
+
+    @pytest.mark.asyncio
     async def test_get_context_window_with_no_messages(self, session_manager, test_session):
         """Test that get_context_window returns empty list when no messages"""
         context = await session_manager.get_context_window(test_session.id)
 
         assert context == []
 
+    @pytest.mark.asyncio
     async def test_get_session_creates_new_session_if_none_exists(self, session_manager, test_user, telegram_user, mock_redis, test_db_session):
         """Test that get_session creates a new session if user has none"""
-        mock_redis.get = AsyncMock(return_value=None)
-        mock_redis.setex = AsyncMock(return_value=True)
-
         # Delete any existing sessions for this user
         from sqlalchemy import delete
         await test_db_session.execute(delete(SessionModel).where(SessionModel.user_id == test_user.id))
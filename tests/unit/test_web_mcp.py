@@ -0,0 +1,213 @@
+"""Unit tests for WebMCP"""
+
+import asyncio
+import pytest
+from unittest.mock import patch
+
+from bot.mcp.plugins.web import WebMCP, _MAX_BATCH_URLS, _MAX_BODY_BYTES
+
+
+class _FakeContent:
+    """Response body that hands out fixed chunks and counts how many were read"""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.chunks_read = 0
+
+    async def iter_chunked(self, n):
+        for chunk in self.chunks:
+            self.chunks_read += 1
+            yield chunk
+
+
+class _FakeResponse:
+    """Just enough of aiohttp.ClientResponse for WebMCP"""
+
+    def __init__(self, chunks, status=200, content_type="text/html", charset="utf-8"):
+        self.status = status
+        self.charset = charset
+        self.headers = {"content-type": content_type}
+        self.content = _FakeContent(chunks)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+class _FakeHttpClient:
+    """HTTP client whose get/post always return the same canned response"""
+
+    def __init__(self, response):
+        self.response = response
+
+    def get(self, url, **kwargs):
+        return self.response
+
+    def post(self, url, **kwargs):
+        return self.response
+
+
+def _ddg_result(i):
+    """One result block as served by html.duckduckgo.com"""
+    target = f"https%3A%2F%2Fexample.com%2Fpage{i}%3Fq%3D1"
+    return (
+        '<div class="result results_links results_links_deep web-result ">'
+        '<div class="links_main links_deep result__body">'
+        f'<h2 class="result__title"><a rel="nofollow" class="result__a" '
+        f'href="//duckduckgo.com/l/?uddg={target}&amp;rut=abc">Title <b>{i}</b></a></h2>'
+        f'<a class="result__url" href="//duckduckgo.com/l/?uddg={target}&amp;rut=abc">example.com/page{i}</a>'
+        f'<a class="result__snippet" href="//duckduckgo.com/l/?uddg={target}">Snippet {i}</a>'
+        '</div></div>'
+    )
+
+
+def _chunked(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.unit
+class TestWebMCPFetch:
+    """Test in-memory caching and deduplication of URL fetches"""
+
+    @pytest.fixture
+    def web_mcp(self):
+        """Create WebMCP without Redis and with every domain allowed"""
+        return WebMCP({"allow_all_domains": True})
+
+    @pytest.mark.asyncio
+    async def test_concurrent_fetches_of_same_url_share_one_download(self, web_mcp):
+        """Test that callers arriving while a fetch is in flight all join it"""
+        async def slow_download(url):
+            await asyncio.sleep(0.01)
+            return {"success": True, "url": url, "content": "ok"}
+
+        with patch.object(web_mcp, "_download_url", side_effect=slow_download) as download:
+            results = await asyncio.gather(
+                *(web_mcp._fetch_url("https://example.com/page") for _ in range(5))
+            )
+
+        download.assert_awaited_once()
+        assert all(result["content"] == "ok" for result in results)
+        assert web_mcp._url_fetches == {}
+
+    @pytest.mark.asyncio
+    async def test_failed_fetch_is_retried_by_later_callers(self, web_mcp):
+        """Test that an unsuccessful result is neither cached nor kept in flight"""
+        with patch.object(
+            web_mcp, "_download_url", return_value={"success": False, "error": "timeout"}
+        ) as download:
+            await web_mcp._fetch_url("https://example.com/page")
+            await asyncio.sleep(0)
+            await web_mcp._fetch_url("https://example.com/page")
+
+        assert download.await_count == 2
+
+
+@pytest.mark.unit
+class TestWebMCPBatch:
+    """Test the web.batch tool"""
+
+    @pytest.fixture
+    def web_mcp(self):
+        """Create WebMCP without Redis, restricted to one allowed domain"""
+        return WebMCP({"allowed_domains": {"example.com"}})
+
+    @pytest.mark.asyncio
+    async def test_batch_keeps_input_order_and_isolates_failures(self, web_mcp):
+        """Test that failing and disallowed URLs become error entries in place"""
+        async def download(url):
+            if url.endswith("/broken"):
+                raise Exception("Failed to fetch URL: status 500")
+            # Finish in reverse order of the input
+            await asyncio.sleep(0.01 if url.endswith("/first") else 0)
+            return {"success": True, "url": url, "content": url}
+
+        urls = [
+            "https://example.com/first",
+            "https://example.com/broken",
+            "https://not-allowed.org/page",
+            "https://example.com/last",
+        ]
+        with patch.object(web_mcp, "_download_url", side_effect=download):
+            result = await web_mcp.execute_tool("web.batch", {"ids": urls})
+
+        results = result["results"]
+        assert [entry["url"] for entry in results] == urls
+        assert [entry["success"] for entry in results] == [True, False, False, True]
+        assert "not allowed" in results[2]["error"]
+
+    @pytest.mark.asyncio
+    async def test_batch_rejects_too_many_urls(self, web_mcp):
+        """Test that a batch over the cap is refused before anything is fetched"""
+        tools = await web_mcp.get_tools()
+        batch_schema = next(tool for tool in tools if tool["function"]["name"] == "web.batch")
+        assert batch_schema["function"]["parameters"]["properties"]["ids"]["maxItems"] == _MAX_BATCH_URLS
+
+        urls = [f"https://example.com/{i}" for i in range(_MAX_BATCH_URLS + 1)]
+        with patch.object(web_mcp, "_download_url") as download:
+            with pytest.raises(ValueError, match="At most"):
+                await web_mcp.execute_tool("web.batch", {"ids": urls})
+
+        download.assert_not_called()
+
+
+@pytest.mark.unit
+class TestWebMCPDownload:
+    """Test DuckDuckGo result parsing and body download limits"""
+
+    @pytest.mark.asyncio
+    async def test_search_parses_chunked_results_and_stops_at_top_n(self):
+        """Test that results are parsed as chunks arrive and reading stops at top_n"""
+        page = (
+            '<html><body><div id="links" class="results">'
+            + "".join(_ddg_result(i) for i in range(1, 6))
+            + "</div></body></html>"
+        ).encode()
+        response = _FakeResponse(_chunked(page, 200))
+        web_mcp = WebMCP({}, http_client=_FakeHttpClient(response))
+
+        result = await web_mcp._search_duckduckgo("test query", top_n=2)
+
+        assert result["total_results"] == 2
+        assert result["results"] == [
+            {"title": "Title 1", "snippet": "Snippet 1", "url": "https://example.com/page1?q=1"},
+            {"title": "Title 2", "snippet": "Snippet 2", "url": "https://example.com/page2?q=1"},
+        ]
+        # The rest of the page was never read
+        assert response.content.chunks_read < len(response.content.chunks)
+
+    @pytest.mark.asyncio
+    async def test_search_returns_all_results_when_fewer_than_top_n(self):
+        """Test that a short page is parsed to the end"""
+        page = ("<html><body>" + _ddg_result(1) + "</body></html>").encode()
+        response = _FakeResponse(_chunked(page, 64))
+        web_mcp = WebMCP({}, http_client=_FakeHttpClient(response))
+
+        result = await web_mcp._search_duckduckgo("test query", top_n=5)
+
+        assert [entry["url"] for entry in result["results"]] == ["https://example.com/page1?q=1"]
+
+    @pytest.mark.asyncio
+    async def test_read_text_caps_the_body(self):
+        """Test that at most _MAX_BODY_BYTES are downloaded and decoded"""
+        response = _FakeResponse([b"a" * 16384] * 32)
+        web_mcp = WebMCP({})
+
+        text = await web_mcp._read_text(response)
+
+        assert len(text) == _MAX_BODY_BYTES
+        assert response.content.chunks_read == _MAX_BODY_BYTES // 16384
+
+    @pytest.mark.asyncio
+    async def test_download_rejects_binary_content(self):
+        """Test that non-text responses are refused without reading the body"""
+        response = _FakeResponse([b"%PDF-1.7"], content_type="application/pdf")
+        web_mcp = WebMCP({}, http_client=_FakeHttpClient(response))
+
+        result = await web_mcp._download_url("https://example.com/file.pdf")
+
+        assert result["success"] is False
+        assert "Unsupported content type" in result["error"]
+        assert response.content.chunks_read == 0